@@ -83,10 +83,12 @@ async def main(message: cl.Message):
         if results:
             result_table = tabulate(results, headers=columns, tablefmt="github")
             await cl.Message(content=result_table).send()
-            table_rag.add_message({"role":"assistant", "content": result_table})
+            # The LLM only sees a bounded digest, the full table stays in the UI
+            result_digest = table_rag.digest_result(results, columns)
+            table_rag.add_message({"role":"assistant", "content": result_digest})
 
             # Explain the result
-            explanation_result = await explain_result(result_table, prompt)
+            explanation_result = await explain_result(result_digest, prompt)
             if "error" in explanation_result:
                 await cl.Message(content=f"Error: {explanation_result['error']}").send()
                 return
@@ -96,7 +98,7 @@ async def main(message: cl.Message):
             await cl.Message(content=f"Explanation: {explanation}").send()
 
             # Dig deeper into the result
-            dig_deeper_result = await dig_deeper(sql_query, result_table, prompt, explanation)
+            dig_deeper_result = await dig_deeper(sql_query, result_digest, prompt, explanation)
             if "error" in dig_deeper_result:
                 await cl.Message(content=f"Error: {dig_deeper_result['error']}").send()
                 return
@@ -111,11 +113,12 @@ async def main(message: cl.Message):
             try:
                 deeper_results, deeper_columns = deeper_result_tuple["results"], deeper_result_tuple["columns"]
                 deeper_result_table = tabulate(deeper_results, headers=deeper_columns, tablefmt="github")
-                table_rag.add_message({"role":"assistant", "content": deeper_result_table})
+                deeper_result_digest = table_rag.digest_result(deeper_results, deeper_columns)
+                table_rag.add_message({"role":"assistant", "content": deeper_result_digest})
                 await cl.Message(content=f"Deeper Result:\n{deeper_result_table}").send()
 
                 # Explain the deeper result
-                deeper_explanation_result = await explain_result(deeper_results, prompt)
+                deeper_explanation_result = await explain_result(deeper_result_digest, prompt)
                 if "error" in deeper_explanation_result:
                     # send just the explain
                     #await cl.Message(content=f"Error: {deeper_explanation_result['error']}").send()
@@ -32,20 +32,23 @@ if __name__ == "__main__":
                 results, columns = result_tuple
                 if results:
                     result = tabulate(results, headers=columns, tablefmt="grid")
-                    table_rag.add_message({"role":"assistant", "content": result})
+                    # The LLM only sees a bounded digest of the result
+                    result_digest = table_rag.digest_result(results, columns)
+                    table_rag.add_message({"role":"assistant", "content": result_digest})
                     # Use tabulate to print the table
                     print(result)
 
-                    explanation = await table_rag.explain_result(result, prompt)
+                    explanation = await table_rag.explain_result(result_digest, prompt)
 
                     # dig deeper
                     try:
-                        dig_deeper_sql = await table_rag.dig_deeper(sql_query, result, prompt, explanation)
+                        dig_deeper_sql = await table_rag.dig_deeper(sql_query, result_digest, prompt, explanation)
 
                         result_tuple = await table_rag.execute_sql_query(prompt, dig_deeper_sql)
                         results, columns = result_tuple
 
-                        explanation = await table_rag.explain_result(results, prompt)
+                        explanation = await table_rag.explain_result(
+                            table_rag.digest_result(results, columns), prompt)
                         
                     except Exception as e:
                         logging.error(f"Error in dig deeper: {e}")
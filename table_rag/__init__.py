@@ -1,11 +1,20 @@
-import sqlite3
+import asyncio
+import copy
 import json
 import logging
 import os
-# Assuming you're using OpenAI API for LLM
-import json_repair
 import re
 
+import openai
+
+from table_rag.backends import SQLiteBackend
+from table_rag.catalog import build_catalog
+from table_rag.cell_store import CellStore, CellStoreBuilder, cell_store_source
+from table_rag.parsing import extract_json, extract_sql, parse_expansion
+from table_rag.planner import IndexAdvisor, QueryPlanError, QueryPlanner
+from table_rag.rollups import ROLLUP_SCHEMA, RollupCache
+from table_rag.summarize import summarize_result
+
 LLM_API_SERVER = os.environ.get("LLM_API_SERVER", "http://localhost:11434/v1")
 LLM_API_KEY = os.environ.get("LLM_API_KEY", "ollama")
 LLM_MODEL = os.environ.get("LLM_MODEL", "mistral-nemo")
@@ -14,6 +23,25 @@ logging.basicConfig(level=logging.INFO)
 
 logging.debug(f"Using LLM API Server: {LLM_API_SERVER}, model: {LLM_MODEL}")
 
+# JSON schema of the fused expansion + generation response
+FUSED_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "columns": {"type": "array", "items": {"type": "string"}},
+        "cell_values": {"type": "array", "items": {"type": "string"}},
+        "sql": {"type": "string"},
+    },
+    "required": ["columns", "cell_values", "sql"],
+    "additionalProperties": False,
+}
+
+# Words of a question that are never looked up in the cell database
+QUESTION_STOPWORDS = {
+    "a", "all", "an", "and", "are", "by", "did", "do", "does", "each", "for", "from",
+    "how", "in", "is", "last", "many", "me", "most", "much", "of", "on", "or", "per",
+    "show", "the", "to", "was", "were", "what", "which", "who", "with",
+}
+
 # Helper function to load prompt templates
 
 
@@ -22,19 +50,63 @@ def load_prompt_template(file_path):
         return file.read()
 
 
+def _shared_attribute(name):
+    # Stored in the dict a TableRAG shares with its sessions, so a rebuilt
+    # catalog or a disabled feature is seen by all of them
+    return property(lambda self: self._shared[name],
+                    lambda self, value: self._shared.__setitem__(name, value))
+
+
 class TableRAG:
-    def __init__(self, db_path, llm_client, cell_encoding_budget=1000, retry_execute=3):
+    schema = _shared_attribute("schema")
+    foreign_keys = _shared_attribute("foreign_keys")
+    schema_signature = _shared_attribute("schema_signature")
+    structured_output = _shared_attribute("structured_output")
+    _schema_statements = _shared_attribute("schema_statements")
+
+    def __init__(self, db_path, llm_client, cell_encoding_budget=1000, retry_execute=3, cell_store_path=None,
+                 catalog_workers=None, catalog_use_processes=False, backend=None,
+                 max_plan_cost=10_000_000, auto_create_indexes=False, rollup_path=None,
+                 result_digest_rows=30, fused_generation=False, structured_output=True):
+        # Catalog caches and learned flags, shared with every session()
+        self._shared = {}
         self.db_path = db_path
+        # Engine used for introspection, sampling and execution (SQLite by default)
+        self.backend = backend or SQLiteBackend(db_path)
+        # Rejects queries whose avoidable plan cost exceeds max_plan_cost (None disables)
+        self.query_planner = QueryPlanner(self.backend, max_plan_cost=max_plan_cost)
+        self.index_advisor = IndexAdvisor(self.query_planner)
+        self.auto_create_indexes = auto_create_indexes
         self.llm_client = llm_client
         self.cell_encoding_budget = cell_encoding_budget
         self.retry_execute = retry_execute
+        # Optional file the cell database is saved to and mapped from, shared by workers
+        self.cell_store_path = cell_store_path
+        # Degree of parallelism for the catalog build (None = one worker per CPU)
+        self.catalog_workers = catalog_workers
+        self.catalog_use_processes = catalog_use_processes
+
+        # Results longer than this are summarized before they are sent to the LLM
+        self.result_digest_rows = result_digest_rows
+
+        # Ask for columns, cell values and SQL in one LLM call, with cells retrieved locally
+        self.fused_generation = fused_generation
+        # Constrain the fused response with a JSON schema (response_format), when the server supports it
+        self.structured_output = structured_output
 
         self.history_message = []
 
-        schema_keys = self.schema_retrieval()
-        self.schema = schema_keys[0]
-        self.foreign_keys = schema_keys[1]
-        self.cell_database = self.build_cell_db()
+        # (schema, CREATE statements) of the last prompt, rebuilt when the schema changes
+        self._schema_statements = None
+        self.schema, self.foreign_keys, self.cell_database = self.load_catalog()
+        # Sidecar database of materialized rollups for recurring GROUP BY queries
+        self.rollup_cache = None
+        if rollup_path:
+            if isinstance(self.backend, SQLiteBackend):
+                self.rollup_cache = RollupCache(db_path, rollup_path, self.schema)
+                self.backend.attach(ROLLUP_SCHEMA, rollup_path)
+            else:
+                logging.warning("Rollups are only supported with the SQLite backend")
         # Load prompt templates
         self.query_expansion_prompt_template = load_prompt_template(
             'prompts/query_expansion.prompt')
@@ -48,75 +120,96 @@ class TableRAG:
             'prompts/explain_result.prompt')  # For result explanation
         self.dig_deeper_prompt_template = load_prompt_template(
             'prompts/dig_deeper.prompt')
+        self.fused_generation_prompt_template = load_prompt_template(
+            'prompts/fused_generation.prompt')
 
     def add_message(self, message):
         self.history_message.append(message)
 
-    def schema_retrieval(self, max_sample_length=100):
-        logging.debug("Doing schema Retrieval")
-        schema = {}
-        foreign_keys = {}
+    def session(self):
+        """
+        Returns a TableRAG that shares this catalog, backend and caches but keeps its own message history.
+        """
+        session = copy.copy(self)
+        session.history_message = []
+        return session
 
+    def build_catalog(self, max_sample_length=100, cell_encoding_budget=None):
+        """
+        Builds schema, foreign keys and optionally cell values for all tables in parallel.
+        """
+        return build_catalog(
+            self.backend,
+            max_sample_length=max_sample_length,
+            cell_encoding_budget=cell_encoding_budget,
+            workers=self.catalog_workers,
+            use_processes=self.catalog_use_processes)
+
+    def load_catalog(self):
+        """
+        Builds the schema and foreign keys, and the cell database unless an up to date
+        one can be mapped from self.cell_store_path. Everything is done in a single pass.
+        """
+        cell_db = self.load_cell_store()
+        # Taken before the build, so changes made while it runs trigger a refresh
+        self.schema_signature = self.backend.signature()
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute(
-                "SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-
-            for table in tables:
-                table_name = table[0]
-                cursor.execute(f"PRAGMA table_info({table_name});")
-                columns = cursor.fetchall()
-
-                schema[table_name] = {
-                    "columns": [
-                        {
-                            "name": column[1],
-                            "type": column[2],
-                            "sample": None
-                        } for column in columns
-                    ]
-                }
-
-                # Extract foreign keys
-                cursor.execute(f"PRAGMA foreign_key_list({table_name});")
-                foreign_key_info = cursor.fetchall()
-
-                foreign_keys[table_name] = [
-                    {
-                        "from": fk[3],  # local column
-                        "to_table": fk[2],  # referenced table
-                        "to": fk[4]  # referenced column
-                    }
-                    for fk in foreign_key_info
-                ]
-
-                # Get sample data
-                cursor.execute(f"SELECT * FROM {table_name} LIMIT 1;")
-                sample_row = cursor.fetchone()
+            schema, foreign_keys, cell_builder = self.build_catalog(
+                cell_encoding_budget=None if cell_db else self.cell_encoding_budget)
+        except self.backend.error_types as e:
+            logging.error(f"Failed to build catalog: {e}")
+            schema, foreign_keys, cell_builder = {}, {}, None
 
-                if sample_row:
-                    for idx, column in enumerate(schema[table_name]["columns"]):
-                        sample_value = sample_row[idx]
-                        if isinstance(sample_value, str) and len(sample_value) > max_sample_length:
-                            column["sample"] = sample_value[:max_sample_length] + "..."
-                        else:
-                            column["sample"] = sample_value
+        if cell_db is None:
+            cell_db = self.finish_cell_db(cell_builder)
+        return schema, foreign_keys, cell_db
 
-            conn.close()
+    def schema_retrieval(self, max_sample_length=100):
+        """
+        Returns the cached schema and foreign keys, rebuilt only when the database has changed.
+        """
+        signature = self.backend.signature()
+        if signature == self.schema_signature:
+            return self.schema, self.foreign_keys
 
-        except sqlite3.Error as e:
+        logging.debug("Doing schema Retrieval")
+        try:
+            schema, foreign_keys, _ = self.build_catalog(max_sample_length)
+        except self.backend.error_types as e:
             logging.error(f"Failed to retrieve database schema: {e}")
+            return self.schema, self.foreign_keys
 
+        self.schema, self.foreign_keys, self.schema_signature = schema, foreign_keys, signature
+        if self.rollup_cache:
+            self.rollup_cache.schema = schema
         return schema, foreign_keys
 
     def schema_to_create_statements(self):
-        create_statements = []
-
         # Retrieve schema and foreign key information
         schema, foreign_keys = self.schema_retrieval()
+        if self._schema_statements is None or self._schema_statements[0] is not schema:
+            self._schema_statements = (schema, self.table_create_statements(schema, foreign_keys))
+        create_statements = list(self._schema_statements[1])
+
+        # Expose the materialized rollups so the generator can read from them directly
+        if self.rollup_cache:
+            rollup_statements = self.rollup_cache.describe()
+            if rollup_statements:
+                create_statements.append(rollup_statements)
+
+        logging.debug("Schema to Create Statements: \n" +
+                      "\n".join(create_statements))
+        return "\n".join(create_statements)
+
+    async def schema_prompt(self):
+        """
+        Returns schema_to_create_statements() without blocking the event loop, the
+        schema may be rebuilt and the rollup catalog is read from the database.
+        """
+        return await asyncio.to_thread(self.schema_to_create_statements)
+
+    def table_create_statements(self, schema, foreign_keys):
+        create_statements = []
 
         for table_name, table_data in schema.items():
             columns = table_data["columns"]
@@ -149,45 +242,55 @@ class TableRAG:
                     join_comment = f"-- {table_name}.{column['name']} might join with {inferred_table}.id"
                     create_statements.append(join_comment)
 
-        logging.debug("Schema to Create Statements: \n" +
-                      "\n".join(create_statements))
-        return "\n".join(create_statements)
+        return create_statements
+
+    def load_cell_store(self):
+        """
+        Maps the cell database from self.cell_store_path if it exists and is up to date.
+        """
+        if not self.cell_store_path or not os.path.exists(self.cell_store_path):
+            return None
+        try:
+            cell_db = CellStore.load(self.cell_store_path)
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to load cell store: {e}")
+            return None
+        if cell_db.source != cell_store_source(self.backend.signature(), self.cell_encoding_budget):
+            logging.info("Cell store is stale, rebuilding")
+            return None
+        logging.info(
+            f"Mapped cell database from {self.cell_store_path} ({cell_db.memory_usage()} bytes)")
+        return cell_db
+
+    def finish_cell_db(self, cell_builder):
+        """
+        Packs collected cell values into a CellStore and saves it to self.cell_store_path.
+        """
+        if cell_builder is None:
+            cell_builder = CellStoreBuilder(self.cell_encoding_budget)
+        cell_db = cell_builder.build(
+            source=cell_store_source(self.backend.signature(), self.cell_encoding_budget))
+        logging.info(f"Built cell database ({cell_db.memory_usage()} bytes)")
+        if self.cell_store_path:
+            try:
+                cell_db.save(self.cell_store_path)
+            except OSError as e:
+                logging.error(f"Failed to save cell store: {e}")
+        return cell_db
 
     def build_cell_db(self):
         """
         Builds a database of distinct column-value pairs for cell retrieval.
         Only the most frequent/distinct values are kept, respecting the cell encoding budget.
         """
-        cell_db = {}
+        cell_builder = None
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute(
-                "SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-
-            for table in tables:
-                table_name = table[0]
-                cursor.execute(
-                    f"SELECT * FROM {table_name} LIMIT {self.cell_encoding_budget};")
-                rows = cursor.fetchall()
-
-                if rows:
-                    cell_db[table_name] = {}
-                    for row in rows:
-                        for idx, column in enumerate(row):
-                            column_name = self.schema[table_name]["columns"][idx]["name"]
-                            if column_name not in cell_db[table_name]:
-                                cell_db[table_name][column_name] = set()
-                            if len(cell_db[table_name][column_name]) < self.cell_encoding_budget:
-                                cell_db[table_name][column_name].add(column)
-
-            conn.close()
-        except sqlite3.Error as e:
+            _, _, cell_builder = self.build_catalog(
+                cell_encoding_budget=self.cell_encoding_budget)
+        except self.backend.error_types as e:
             logging.error(f"Failed to build cell database: {e}")
 
-        return cell_db
+        return self.finish_cell_db(cell_builder)
 
     def get_relevant_cells(self, table_name, columns, cell_values):
         """
@@ -195,12 +298,12 @@ class TableRAG:
         """
         relevant_cells = {}
         if table_name in self.cell_database:
-            table_cells = self.cell_database[table_name]
+            table_columns = self.cell_database.columns(table_name)
             for column in columns:
-                if column in table_cells:
+                if column in table_columns:
                     # Only return cell values that match or are within the given column
-                    relevant_cells[column] = list(
-                        table_cells[column].intersection(cell_values))
+                    relevant_cells[column] = self.cell_database.lookup(
+                        table_name, column, cell_values)
         return relevant_cells
 
     async def tabular_query_expansion(self, prompt):
@@ -211,7 +314,7 @@ class TableRAG:
 
         # Use the external query_expansion.prompt template
         query_expansion_prompt = self.query_expansion_prompt_template.format(
-            schema=self.schema_to_create_statements(),
+            schema=await self.schema_prompt(),
             user_query=prompt
         )
 
@@ -231,34 +334,119 @@ class TableRAG:
         # Log full response for debugging
         logging.debug(f"Query Expansion Response: {response_text}")
 
-        try:
-            # Extract the JSON part of the response (assuming it’s wrapped in ```json blocks)
-            json_text = re.search(r'```json(.*?)```',
-                                  response_text, re.DOTALL).group(1).strip()
-            logging.debug("Extracted JSON Data: " + json_text)
-            expansion_data = json_repair.loads(json_text)
+        # Tolerates missing fences, partial JSON and alternative key names
+        columns, cell_values = parse_expansion(response_text)
+        if not columns and not cell_values:
+            logging.warning("Query expansion returned no columns or cell values")
+
+        # Log extracted columns and cell values for debugging
+        logging.debug(f"Extracted Columns: {columns}")
+        logging.debug(f"Extracted Cell Values: {cell_values}")
 
-            # Use fallback for 'cell_values' in case it's missing
-            columns = expansion_data.get("columns", [])
-            cell_values = expansion_data.get(
-                "cell_values", expansion_data.get("possible_cell_values", []))
+        return columns, cell_values
 
-            # Log extracted columns and cell values for debugging
-            logging.debug(f"Extracted Columns: {columns}")
-            logging.debug(f"Extracted Cell Values: {cell_values}")
+    def retrieve_cells(self, prompt, max_values=5):
+        """
+        Retrieves the cell values mentioned in a question without the LLM. Each word
+        of the question is prefix-searched in every column of the cell database;
+        values spelled out in the question (ignoring case) win over partial matches.
+        Returns {table: {column: [values]}}.
+        """
+        words = re.findall(r"[\w'-]+", prompt)
+        keywords = [word for word in dict.fromkeys(words)
+                    if len(word) >= 2 and word.lower() not in QUESTION_STOPWORDS]
+        text = f" {' '.join(words).casefold()} "
+
+        relevant_cells = {}
+        for table_name in self.cell_database:
+            for column in self.cell_database.columns(table_name):
+                mentioned, partial = [], []
+                for word in keywords:
+                    # Stored values are mostly lower, title or upper case
+                    for variant in dict.fromkeys((word, word.lower(), word.title(), word.upper())):
+                        for value in self.cell_database.prefix_search(
+                                table_name, column, variant, limit=50):
+                            value_words = " ".join(re.findall(r"[\w'-]+", value)).casefold()
+                            if value_words and f" {value_words} " in text:
+                                mentioned.append(value)
+                            elif len(word) >= 4:
+                                partial.append(value)
+                values = list(dict.fromkeys(mentioned or partial))[:max_values]
+                if values:
+                    relevant_cells.setdefault(table_name, {})[column] = values
+        return relevant_cells
 
-            return columns, cell_values
+    async def structured_completion(self, messages, schema_name, schema):
+        """
+        Requests a JSON response constrained by a JSON schema, falling back to a
+        plain completion if the server does not support response_format.
+        """
+        if self.structured_output:
+            try:
+                return await self.llm_client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    stream=False,
+                    response_format={
+                        "type": "json_schema",
+                        "json_schema": {"name": schema_name, "schema": schema, "strict": True},
+                    }
+                )
+            except openai.BadRequestError as e:
+                # Only a rejected request means the server lacks response_format;
+                # timeouts and server errors are raised as usual
+                logging.warning(f"Structured output is not supported, disabling it: {e}")
+                self.structured_output = False
+
+        return await self.llm_client.chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            stream=False
+        )
 
-        except json.JSONDecodeError:
-            raise ValueError("Failed to decode query expansion response")
-        except KeyError as e:
-            logging.error(f"Missing key in the expansion data: {e}")
-            raise ValueError(f"Failed to extract necessary data: {str(e)}")
+    async def fused_sql_query(self, natural_language_query):
+        """
+        Generates a SQL query in a single LLM call: cells are retrieved locally and
+        the LLM returns the relevant columns, cell values and the query as JSON.
+        """
+        relevant_cells = await asyncio.to_thread(self.retrieve_cells, natural_language_query)
+
+        fused_prompt = self.fused_generation_prompt_template.format(
+            dialect=self.backend.dialect,
+            schema=await self.schema_prompt(),
+            cell_values=json.dumps(relevant_cells, indent=4),
+            user_query=natural_language_query
+        )
+
+        logging.debug(fused_prompt)
+
+        response = await self.structured_completion(
+            [*self.history_message, {"role": "user", "content": fused_prompt}],
+            "sql_generation", FUSED_RESPONSE_SCHEMA)
+
+        response_text = response.choices[0].message.content.strip()
+        logging.debug(f"Fused Generation Response: {response_text}")
+
+        # Parsed once, then each part is extracted tolerantly
+        data = extract_json(response_text)
+        columns, cell_values = parse_expansion(data or {})
+        logging.debug(f"Extracted Columns: {columns}")
+        logging.debug(f"Extracted Cell Values: {cell_values}")
+
+        sql_query = extract_sql(data or {}) or extract_sql(response_text)
+        if not sql_query:
+            raise ValueError("No SQL query found in the generation response")
+
+        logging.debug("Extracted SQL Query: " + sql_query)
+        return sql_query
 
     async def generate_sql_query(self, natural_language_query):
         """
         Generate SQL query from natural language input using query expansion and retrieval.
         """
+        if self.fused_generation:
+            return await self.fused_sql_query(natural_language_query)
+
         # Step 1: Expand the query
         columns, cell_values = await self.tabular_query_expansion(natural_language_query)
 
@@ -270,7 +458,8 @@ class TableRAG:
 
         # Step 3: Use the relevant cells for query generation
         sql_prompt = self.sql_generation_prompt_template.format(
-            schema=self.schema_to_create_statements(),
+            dialect=self.backend.dialect,
+            schema=await self.schema_prompt(),
             user_query=natural_language_query,
             columns=columns,
             cell_values=json.dumps(relevant_cells, indent=4)
@@ -290,8 +479,9 @@ class TableRAG:
         sql_query = response.choices[0].message.content.strip()
         logging.debug("Generated SQL Query: " + sql_query)
 
-        sql_query = re.search(r'```sql(.*?)```', sql_query,
-                              re.DOTALL).group(1).strip()
+        sql_query = extract_sql(sql_query)
+        if not sql_query:
+            raise ValueError("No SQL query found in the generation response")
 
         logging.debug("Extracted SQL Query: " + sql_query)
 
@@ -326,16 +516,10 @@ class TableRAG:
             try:
                 logging.debug(
                     f"Executing SQL query (Attempt {attempt + 1}/{self.retry_execute}): {sql_query}")
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                # Ensure sql_query is a string, not coroutine
-                cursor.execute(sql_query)
-                results = cursor.fetchall()
-                columns = [description[0]
-                           for description in cursor.description]
-                conn.close()
+                # Run the query off the event loop, DB work must not stall other requests
+                results, columns = await asyncio.to_thread(self.run_query, sql_query)
                 return results, columns  # Successful execution
-            except sqlite3.Error as e:
+            except (QueryPlanError,) + self.backend.error_types as e:
                 last_error = str(e)
                 logging.error(
                     f"Failed to execute query (Attempt {attempt + 1}): {e}")
@@ -357,6 +541,33 @@ class TableRAG:
             f"Failed to execute the query after {self.retry_execute} attempts.")
         return None, None
 
+    def run_query(self, sql_query):
+        """
+        Runs a query, reading from a rollup when one covers it, otherwise after checking its plan cost.
+        """
+        if self.rollup_cache:
+            try:
+                rollup_query = self.rollup_cache.rewrite(sql_query)
+                if rollup_query:
+                    return self.backend.execute(rollup_query)
+            except self.backend.error_types as e:
+                logging.error(f"Failed to answer query from rollups, running it directly: {e}")
+
+        self.query_planner.check(sql_query)
+        results, columns = self.backend.execute(sql_query)
+        if self.rollup_cache:
+            try:
+                self.rollup_cache.record(sql_query)
+            except self.backend.error_types as e:
+                logging.error(f"Failed to record query for rollups: {e}")
+        if self.auto_create_indexes:
+            # The query already succeeded, a failed index build must not send it to healing
+            try:
+                self.index_advisor.apply()
+            except self.backend.error_types as e:
+                logging.error(f"Failed to create suggested indexes: {e}")
+        return results, columns
+
     async def heal_sql_query(self, prompt, failed_query, error_message):
         """
         Sends the failed SQL query and error message to the LLM, asking for a correction.
@@ -364,10 +575,11 @@ class TableRAG:
         try:
             # Prepare the prompt using the healing prompt template
             healing_prompt = self.query_healing_prompt_template.format(
+                dialect=self.backend.dialect,
                 prompt=prompt,
                 original_query=failed_query,
                 error_message=error_message,
-                schema=self.schema_to_create_statements()
+                schema=await self.schema_prompt()
             )
 
             logging.debug(
@@ -389,16 +601,17 @@ class TableRAG:
             logging.debug(f"Received corrected SQL query: {corrected_query}")
 
             # Extract SQL from code block (if it's inside a code block)
-            corrected_query = re.search(
-                r'```sql(.*?)```', corrected_query, re.DOTALL)
-            if corrected_query:
-                return corrected_query.group(1).strip()
-
-            return corrected_query  # Return the corrected query
+            return extract_sql(corrected_query)  # None if no query was found
         except Exception as e:
             logging.error(f"Failed to heal SQL query: {e}")
             return None  # Return None if healing fails
 
+    def digest_result(self, results, columns):
+        """
+        Returns a bounded-size digest of a query result for explain_result, dig_deeper and the history.
+        """
+        return summarize_result(results, columns, max_rows=self.result_digest_rows)
+
     async def explain_result(self, result, prompt):
         """
         Explains the result of a query using the LLM.
@@ -433,8 +646,9 @@ class TableRAG:
         """
         # Prepare the prompt using the dig_deeper prompt template
         dig_deeper_prompt = self.dig_deeper_prompt_template.format(
+            dialect=self.backend.dialect,
             previous_sql=previous_sql,
-            schema=self.schema_to_create_statements(),
+            schema=await self.schema_prompt(),
             previous_result=previous_result,
             user_query=prompt,
             explaination=explaination
@@ -453,8 +667,9 @@ class TableRAG:
         sql_query = response.choices[0].message.content.strip()
         logging.debug("Generated SQL Query: " + sql_query)
 
-        sql_query = re.search(r'```sql(.*?)```', sql_query,
-                              re.DOTALL).group(1).strip()
+        sql_query = extract_sql(sql_query)
+        if not sql_query:
+            raise ValueError("No SQL query found in the dig deeper response")
 
         logging.debug("Extracted SQL Query: " + sql_query)
 
@@ -0,0 +1,361 @@
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+
+def connect_read_only(db_path):
+    """
+    Opens a read-only connection to a SQLite database file.
+    """
+    return sqlite3.connect(f"{Path(db_path).absolute().as_uri()}?mode=ro", uri=True)
+
+
+def file_signature(path):
+    """
+    Returns a cheap signature (size and mtime) of a file, used to detect stale caches.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _quote_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def sqlite_foreign_keys(cursor, table_name):
+    cursor.execute(f"PRAGMA foreign_key_list({table_name});")
+    return [
+        {
+            "from": fk[3],  # local column
+            "to_table": fk[2],  # referenced table
+            "to": fk[4]  # referenced column
+        }
+        for fk in cursor.fetchall()
+    ]
+
+
+class DatabaseBackend:
+    """
+    Interface for the engine TableRAG introspects, samples and runs queries on.
+
+    connect() must return a DB-API style connection exposing cursor(); cursors
+    need execute(), fetchone(), fetchall() and description. Backends are
+    shipped to catalog workers, so they should only hold picklable settings.
+    """
+
+    # Name of the SQL dialect, used in the generation and healing prompts
+    dialect = "SQL"
+    # Exceptions raised by the engine for bad queries
+    error_types = (Exception,)
+
+    def connect(self):
+        raise NotImplementedError
+
+    def cache_key(self):
+        """
+        Identifies the database; workers keep one connection per key.
+        """
+        raise NotImplementedError
+
+    def signature(self):
+        """
+        Changes whenever the underlying data changes.
+        """
+        return None
+
+    def list_tables(self, cursor):
+        raise NotImplementedError
+
+    def table_columns(self, cursor, table_name):
+        """
+        Returns [(column name, column type), ...] in table order.
+        """
+        raise NotImplementedError
+
+    def foreign_keys(self, cursor, table_name):
+        return []
+
+    def execute(self, sql_query):
+        """
+        Runs a query and returns (rows, column names).
+        """
+        raise NotImplementedError
+
+    def explain(self, sql_query):
+        """
+        Returns the query plan as [(id, parent, unused, detail), ...] rows in the
+        format of SQLite's EXPLAIN QUERY PLAN, or None if not supported.
+        """
+        return None
+
+    def estimate_rows(self, table_name):
+        """
+        Returns an estimate of the number of rows of a table, or None if unknown.
+        """
+        return None
+
+    def list_indexes(self):
+        return []
+
+    def has_index(self, table_name, columns):
+        return False
+
+    def execute_script(self, sql_script):
+        """
+        Runs statements that modify the database, such as CREATE INDEX.
+        """
+        raise NotImplementedError
+
+
+class SQLiteBackend(DatabaseBackend):
+    dialect = "SQLite3"
+    error_types = (sqlite3.Error,)
+
+    def __init__(self, db_path, attachments=None):
+        self.db_path = db_path
+        # {schema name: database path} attached to every query connection
+        self.attachments = dict(attachments or {})
+
+    def attach(self, schema_name, path):
+        self.attachments[schema_name] = path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        for schema_name, path in self.attachments.items():
+            conn.execute(f"ATTACH DATABASE ? AS {schema_name};", (path,))
+        return conn
+
+    def connect(self, read_only=True):
+        if read_only:
+            return connect_read_only(self.db_path)
+        return sqlite3.connect(self.db_path)
+
+    def cache_key(self):
+        return ("sqlite", os.path.abspath(self.db_path))
+
+    def signature(self):
+        return file_signature(self.db_path)
+
+    def list_tables(self, cursor):
+        # Skip internal tables such as sqlite_stat1 written by ANALYZE, and the
+        # change counters kept for rollups
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' "
+            "AND name NOT LIKE 'tablerag\\_%' ESCAPE '\\';")
+        return [table[0] for table in cursor.fetchall()]
+
+    def table_columns(self, cursor, table_name):
+        cursor.execute(f"PRAGMA table_info({table_name});")
+        return [(column[1], column[2]) for column in cursor.fetchall()]
+
+    def foreign_keys(self, cursor, table_name):
+        return sqlite_foreign_keys(cursor, table_name)
+
+    def execute(self, sql_query):
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql_query)
+            results = cursor.fetchall()
+            columns = [description[0] for description in cursor.description]
+            return results, columns
+        finally:
+            conn.close()
+
+    def explain(self, sql_query):
+        conn = self._connect()
+        try:
+            return conn.execute(f"EXPLAIN QUERY PLAN {sql_query}").fetchall()
+        finally:
+            conn.close()
+
+    def estimate_rows(self, table_name):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name IN (?, 'sqlite_stat1');",
+                (table_name,))
+            names = {row[0] for row in cursor.fetchall()}
+            if table_name not in names:
+                return None
+            # Prefer the statistics gathered by ANALYZE
+            if "sqlite_stat1" in names:
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1;", (table_name,))
+                row = cursor.fetchone()
+                if row and row[0]:
+                    return int(row[0].split()[0])
+            try:
+                # O(log n) on rowid tables, exact unless rows were deleted
+                cursor.execute(f'SELECT MAX(rowid) FROM "{table_name}";')
+            except sqlite3.OperationalError:
+                cursor.execute(f'SELECT COUNT(*) FROM "{table_name}";')
+            return cursor.fetchone()[0] or 0
+        finally:
+            conn.close()
+
+    def list_indexes(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index';").fetchall()]
+        finally:
+            conn.close()
+
+    def has_index(self, table_name, columns):
+        columns = set(columns)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            table_info = conn.execute(f'PRAGMA table_info("{table_name}");').fetchall()
+            primary_key = [column for column in table_info if column[5]]
+            if len(primary_key) == 1 and primary_key[0][2].upper() == "INTEGER" \
+                    and columns == {primary_key[0][1]}:
+                return True  # rowid alias
+            for index in conn.execute(f'PRAGMA index_list("{table_name}");').fetchall():
+                index_columns = [row[2] for row in conn.execute(
+                    f'PRAGMA index_info("{index[1]}");').fetchall()]
+                if set(index_columns[:len(columns)]) == columns:
+                    return True
+            return False
+        finally:
+            conn.close()
+
+    def execute_script(self, sql_script):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executescript(sql_script)
+        finally:
+            conn.close()
+
+
+class DuckDBBackend(DatabaseBackend):
+    """
+    Runs queries on an embedded DuckDB engine, which executes aggregations
+    vectorized and multi-threaded.
+
+    The tables of a SQLite file (db_path) and/or local Parquet files
+    (parquet_paths, a list of paths or a {table name: path} mapping) are
+    exposed as views in an in-memory DuckDB database. Requires the optional
+    duckdb package.
+    """
+
+    dialect = "DuckDB"
+
+    def __init__(self, db_path=None, parquet_paths=None, threads=None):
+        if db_path is None and not parquet_paths:
+            raise ValueError("DuckDBBackend needs a SQLite db_path or parquet_paths")
+        self.db_path = db_path
+        if parquet_paths and not isinstance(parquet_paths, dict):
+            parquet_paths = {Path(path).stem: path for path in parquet_paths}
+        self.parquet_paths = dict(parquet_paths or {})
+        self.threads = threads
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def error_types(self):
+        import duckdb
+        return (duckdb.Error,)
+
+    def _open(self):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError(
+                "DuckDBBackend requires the duckdb package (pip install duckdb)")
+
+        conn = duckdb.connect(database=":memory:")
+        if self.threads:
+            conn.execute(f"SET threads = {int(self.threads)};")
+
+        if self.db_path:
+            conn.execute("INSTALL sqlite;")
+            conn.execute("LOAD sqlite;")
+            conn.execute(
+                f"ATTACH {_quote_literal(self.db_path)} AS sqlite_db (TYPE sqlite, READ_ONLY);")
+            for table_name in self._sqlite_tables():
+                conn.execute(
+                    f'CREATE VIEW "{table_name}" AS SELECT * FROM sqlite_db."{table_name}";')
+
+        for table_name, path in self.parquet_paths.items():
+            conn.execute(
+                f'CREATE VIEW "{table_name}" AS SELECT * FROM read_parquet({_quote_literal(path)});')
+
+        logging.debug(f"Opened DuckDB backend with views: {self.cache_key()}")
+        return conn
+
+    def _sqlite_tables(self):
+        conn = connect_read_only(self.db_path)
+        try:
+            return SQLiteBackend(self.db_path).list_tables(conn.cursor())
+        finally:
+            conn.close()
+
+    def connection(self):
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._open()
+            return self._connection
+
+    def connect(self):
+        # DuckDB cursors are independent connections to the same database,
+        # safe to use from other threads.
+        return self.connection().cursor()
+
+    def cache_key(self):
+        return ("duckdb", self.db_path and os.path.abspath(self.db_path),
+                tuple(sorted(self.parquet_paths.items())))
+
+    def signature(self):
+        paths = ([self.db_path] if self.db_path else []) + \
+            [self.parquet_paths[name] for name in sorted(self.parquet_paths)]
+        return [file_signature(path) for path in paths]
+
+    def list_tables(self, cursor):
+        cursor.execute(
+            "SELECT table_name FROM information_schema.tables "
+            "WHERE table_catalog = current_database() AND table_schema = 'main' "
+            "ORDER BY table_name;")
+        return [table[0] for table in cursor.fetchall()]
+
+    def table_columns(self, cursor, table_name):
+        cursor.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_catalog = current_database() AND table_schema = 'main' "
+            "AND table_name = ? ORDER BY ordinal_position;", [table_name])
+        return cursor.fetchall()
+
+    def foreign_keys(self, cursor, table_name):
+        # Views carry no constraints; read them from the SQLite file itself
+        if not self.db_path or table_name in self.parquet_paths:
+            return []
+        conn = connect_read_only(self.db_path)
+        try:
+            return sqlite_foreign_keys(conn.cursor(), table_name)
+        finally:
+            conn.close()
+
+    def execute(self, sql_query):
+        cursor = self.connect()
+        try:
+            cursor.execute(sql_query)
+            results = cursor.fetchall()
+            columns = [description[0] for description in cursor.description]
+            return results, columns
+        finally:
+            cursor.close()
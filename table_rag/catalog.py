@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from table_rag.cell_store import CellStoreBuilder
+
+_local = threading.local()
+
+
+def _worker_connection(backend):
+    # One connection per worker thread/process and database, reused across tables
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = backend.cache_key()
+    if key not in connections:
+        connections[key] = backend.connect()
+    return connections[key]
+
+
+def list_tables(backend):
+    conn = backend.connect()
+    try:
+        return backend.list_tables(conn.cursor())
+    finally:
+        conn.close()
+
+
+def describe_table(backend, cursor, table_name, max_sample_length=100):
+    """
+    Returns the schema entry (columns with a sample value) and foreign keys of a table.
+    """
+    table_schema = {
+        "columns": [
+            {
+                "name": column_name,
+                "type": column_type,
+                "sample": None
+            } for column_name, column_type in backend.table_columns(cursor, table_name)
+        ]
+    }
+
+    foreign_keys = backend.foreign_keys(cursor, table_name)
+
+    cursor.execute(f"SELECT * FROM {table_name} LIMIT 1;")
+    sample_row = cursor.fetchone()
+
+    if sample_row:
+        for idx, column in enumerate(table_schema["columns"]):
+            sample_value = sample_row[idx]
+            if isinstance(sample_value, str) and len(sample_value) > max_sample_length:
+                column["sample"] = sample_value[:max_sample_length] + "..."
+            else:
+                column["sample"] = sample_value
+
+    return table_schema, foreign_keys
+
+
+def collect_cells(cursor, table_name, cell_encoding_budget):
+    """
+    Returns {table: {column: values}} with up to cell_encoding_budget distinct values per column.
+    """
+    builder = CellStoreBuilder(cell_encoding_budget)
+    cursor.execute(f"SELECT * FROM {table_name} LIMIT {cell_encoding_budget};")
+    column_names = [description[0] for description in cursor.description]
+    builder.add_rows(table_name, column_names, cursor.fetchall())
+    return builder.columns
+
+
+def build_table_catalog(backend, table_name, max_sample_length=100, cell_encoding_budget=None):
+    """
+    Builds the catalog entry of a single table. Runs inside a pool worker.
+    """
+    cursor = _worker_connection(backend).cursor()
+    try:
+        table_schema, foreign_keys = describe_table(
+            backend, cursor, table_name, max_sample_length)
+        cells = None
+        if cell_encoding_budget:
+            cells = collect_cells(cursor, table_name, cell_encoding_budget)
+        return table_schema, foreign_keys, cells
+    finally:
+        cursor.close()
+
+
+def log_progress(done, total, table_name):
+    logging.debug(f"Catalogued table {table_name} ({done}/{total})")
+
+
+def build_catalog(backend, max_sample_length=100, cell_encoding_budget=None,
+                  workers=None, use_processes=False, progress=log_progress, tables=None):
+    """
+    Builds the schema, foreign keys and (optionally) cell values of every table
+    (or only of the given tables), fanning the tables out over a thread or process pool.
+
+    Returns (schema, foreign_keys, cell_builder); cell_builder is None when no
+    cell_encoding_budget is given.
+    """
+    if tables is None:
+        tables = list_tables(backend)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tables) or 1))
+    pool_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+
+    results = {}
+    done = 0
+    with pool_class(max_workers=workers) as pool:
+        futures = {
+            pool.submit(build_table_catalog, backend, table_name,
+                        max_sample_length, cell_encoding_budget): table_name
+            for table_name in tables
+        }
+        for future in as_completed(futures):
+            table_name = futures[future]
+            try:
+                results[table_name] = future.result()
+            except backend.error_types as e:
+                logging.error(f"Failed to catalog table {table_name}: {e}")
+            done += 1
+            if progress:
+                progress(done, len(tables), table_name)
+
+    # Merge the partial results in sqlite_master order
+    schema = {}
+    foreign_keys = {}
+    cell_builder = CellStoreBuilder(cell_encoding_budget) if cell_encoding_budget else None
+    for table_name in tables:
+        if table_name not in results:
+            continue
+        table_schema, table_foreign_keys, cells = results[table_name]
+        schema[table_name] = table_schema
+        foreign_keys[table_name] = table_foreign_keys
+        if cell_builder is not None and cells:
+            cell_builder.merge(cells)
+
+    return schema, foreign_keys, cell_builder
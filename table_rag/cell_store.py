@@ -0,0 +1,269 @@
+import json
+import logging
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+# File layout: magic, header length, JSON header, then the 8-byte aligned
+# string buffer, string offsets and per-column id arrays.
+CELL_STORE_MAGIC = b"TRCELL01"
+_HEADER_STRUCT = struct.Struct("<8sQ")
+_ALIGNMENT = 8
+
+
+def _align(position):
+    return (position + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def cell_store_source(signature, cell_encoding_budget):
+    """
+    Identifies what a cell store was built from; a saved store is reused only if it matches.
+    """
+    return {"signature": signature, "cell_encoding_budget": cell_encoding_budget}
+
+
+class CellStoreBuilder:
+    """
+    Collects distinct column values and packs them into a CellStore.
+    """
+
+    def __init__(self, cell_encoding_budget=1000):
+        self.cell_encoding_budget = cell_encoding_budget
+        self.columns = {}
+
+    def add(self, table_name, column_name, value):
+        if value is None:
+            return
+        values = self.columns.setdefault(table_name, {}).setdefault(column_name, set())
+        if len(values) < self.cell_encoding_budget:
+            values.add(str(value))
+
+    def add_rows(self, table_name, column_names, rows):
+        for row in rows:
+            for column_name, value in zip(column_names, row):
+                self.add(table_name, column_name, value)
+
+    def merge(self, columns):
+        """
+        Merges a {table: {column: values}} mapping, e.g. collected by another worker.
+        """
+        for table_name, table_columns in columns.items():
+            for column_name, values in table_columns.items():
+                for value in values:
+                    self.add(table_name, column_name, value)
+
+    def build(self, source=None):
+        # Intern every distinct value once. Ids are assigned in sorted order, so
+        # a sorted array of ids is also sorted by value and can be bisected.
+        strings = sorted({
+            value
+            for table_columns in self.columns.values()
+            for values in table_columns.values()
+            for value in values
+        })
+        ids = {value: idx for idx, value in enumerate(strings)}
+
+        encoded = [value.encode("utf-8") for value in strings]
+        offsets = array("Q", [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        data = b"".join(encoded)
+
+        tables = {}
+        for table_name, table_columns in self.columns.items():
+            tables[table_name] = {
+                column_name: array("I", sorted(ids[value] for value in values))
+                for column_name, values in table_columns.items()
+            }
+
+        return CellStore(data, offsets, tables, source=source)
+
+
+class CellStore:
+    """
+    Compact, dictionary-encoded storage for the cell database.
+
+    Distinct values are stored once in a contiguous UTF-8 buffer, and every
+    column holds a sorted array of value ids. Exact and prefix lookups are
+    binary searches over those arrays. A store can be saved to disk and
+    mapped read-only by any number of worker processes.
+    """
+
+    def __init__(self, data, offsets, tables, source=None, mapped=None):
+        self._data = data
+        self._offsets = offsets
+        self._tables = tables
+        self.source = source
+        self._mapped = mapped
+
+    def __contains__(self, table_name):
+        return table_name in self._tables
+
+    def __iter__(self):
+        return iter(self._tables)
+
+    def __len__(self):
+        return len(self._tables)
+
+    def columns(self, table_name):
+        return list(self._tables.get(table_name, {}))
+
+    def _value_bytes(self, value_id):
+        return bytes(self._data[self._offsets[value_id]:self._offsets[value_id + 1]])
+
+    def value(self, value_id):
+        return self._value_bytes(value_id).decode("utf-8")
+
+    def values(self, table_name, column_name):
+        ids = self._tables.get(table_name, {}).get(column_name, ())
+        return [self.value(value_id) for value_id in ids]
+
+    def contains(self, table_name, column_name, value):
+        ids = self._tables.get(table_name, {}).get(column_name)
+        if not ids:
+            return False
+        needle = str(value).encode("utf-8")
+        idx = bisect_left(ids, needle, key=self._value_bytes)
+        return idx < len(ids) and self._value_bytes(ids[idx]) == needle
+
+    def lookup(self, table_name, column_name, values):
+        """
+        Returns the given values that are present in the column.
+        """
+        return [str(value) for value in dict.fromkeys(values)
+                if self.contains(table_name, column_name, value)]
+
+    def prefix_search(self, table_name, column_name, prefix, limit=None):
+        """
+        Returns the column values starting with prefix, in sorted order.
+        """
+        ids = self._tables.get(table_name, {}).get(column_name)
+        if not ids:
+            return []
+        needle = str(prefix).encode("utf-8")
+        matches = []
+        idx = bisect_left(ids, needle, key=self._value_bytes)
+        while idx < len(ids) and (limit is None or len(matches) < limit):
+            candidate = self._value_bytes(ids[idx])
+            if not candidate.startswith(needle):
+                break
+            matches.append(candidate.decode("utf-8"))
+            idx += 1
+        return matches
+
+    def memory_usage(self):
+        """
+        Returns the number of bytes used by the value buffer, offsets and column arrays.
+        """
+        total = len(self._data) + len(self._offsets) * self._offsets.itemsize
+        for table_columns in self._tables.values():
+            for ids in table_columns.values():
+                total += len(ids) * ids.itemsize
+        return total
+
+    def save(self, path):
+        """
+        Writes the store to path so other processes can open it with CellStore.load.
+        """
+        sections = [memoryview(self._data), memoryview(self._offsets)]
+        layout = {}
+        for table_name, table_columns in self._tables.items():
+            layout[table_name] = {}
+            for column_name, ids in table_columns.items():
+                layout[table_name][column_name] = len(sections)
+                sections.append(memoryview(ids))
+
+        # Offsets are relative to the first aligned byte after the header.
+        positions = []
+        position = 0
+        for section in sections:
+            position = _align(position)
+            positions.append([position, section.nbytes])
+            position += section.nbytes
+
+        header = json.dumps({
+            "source": self.source,
+            "value_count": len(self._offsets) - 1,
+            "sections": positions,
+            "tables": layout,
+        }).encode("utf-8")
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_HEADER_STRUCT.pack(CELL_STORE_MAGIC, len(header)))
+            file.write(header)
+            base = _align(file.tell())
+            for section, (start, _) in zip(sections, positions):
+                file.write(b"\0" * (base + start - file.tell()))
+                file.write(section)
+        os.replace(tmp_path, path)
+        logging.debug(f"Saved cell store to {path}")
+
+    @classmethod
+    def load(cls, path):
+        """
+        Maps a saved store read-only. Pages are shared between processes mapping the same file.
+        """
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            return cls._from_mapping(path, mapped)
+        except ValueError:
+            # Raised before any view of the mapping is taken
+            mapped.close()
+            raise
+
+    @classmethod
+    def _from_mapping(cls, path, mapped):
+        if len(mapped) < _HEADER_STRUCT.size:
+            raise ValueError(f"{path} is not a cell store file")
+        magic, header_length = _HEADER_STRUCT.unpack_from(mapped, 0)
+        if magic != CELL_STORE_MAGIC:
+            raise ValueError(f"{path} is not a cell store file")
+        header_start = _HEADER_STRUCT.size
+        if header_start + header_length > len(mapped):
+            raise ValueError(f"{path} is truncated")
+        try:
+            header = json.loads(mapped[header_start:header_start + header_length])
+            sections = [(int(start), int(length)) for start, length in header["sections"]]
+            layout = header["tables"]
+            value_count = int(header["value_count"])
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"{path} has an invalid header: {e}")
+        base = _align(header_start + header_length)
+
+        item_sizes = [1, 8] + [4] * (len(sections) - 2)
+        if len(sections) < 2 or sections[1][1] != (value_count + 1) * 8:
+            raise ValueError(f"{path} has an invalid header")
+        for (start, length), item_size in zip(sections, item_sizes):
+            if start < 0 or length < 0 or length % item_size or base + start + length > len(mapped):
+                raise ValueError(f"{path} is truncated")
+
+        try:
+            valid_layout = all(
+                isinstance(idx, int) and 2 <= idx < len(sections)
+                for table_columns in layout.values() for idx in table_columns.values())
+        except AttributeError:
+            valid_layout = False
+        if not valid_layout:
+            raise ValueError(f"{path} has an invalid header")
+
+        view = memoryview(mapped)
+
+        def section(idx, fmt=None):
+            start, length = sections[idx]
+            chunk = view[base + start:base + start + length]
+            return chunk.cast(fmt) if fmt else chunk
+
+        tables = {
+            table_name: {
+                column_name: section(idx, "I")
+                for column_name, idx in table_columns.items()
+            }
+            for table_name, table_columns in layout.items()
+        }
+        return cls(section(0), section(1, "Q"), tables,
+                   source=header.get("source"), mapped=mapped)
@@ -0,0 +1,341 @@
+"""
+Streams CSV/Parquet files into a SQLite database that TableRAG can query.
+
+Files are loaded in chunks inside transactions (WAL, synchronous=OFF while
+loading), key-like and foreign-key columns are indexed afterwards, and the cell
+store is written in the same pass so TableRAG can map it instead of rebuilding.
+
+    python -m table_rag.ingest sales.csv payroll.parquet --db company.db --cell-store company.cells
+"""
+import argparse
+import csv
+import datetime
+import decimal
+import logging
+import re
+import sqlite3
+from itertools import chain, islice
+from pathlib import Path
+
+from table_rag.backends import SQLiteBackend
+from table_rag.catalog import build_catalog, list_tables
+from table_rag.cell_store import CellStoreBuilder, cell_store_source
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+DATETIME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?$")
+# Plain decimal notation only: int()/float() also accept "1_000", " 12 ", "nan" and "inf".
+# Leading zeros ("01234") mark codes such as zip codes, which must stay text
+INTEGER_PATTERN = re.compile(r"^[+-]?(0|[1-9]\d*)$")
+REAL_PATTERN = re.compile(r"^[+-]?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][+-]?\d+)?$")
+
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _is_int(value):
+    return INTEGER_PATTERN.match(value) is not None
+
+
+def _is_float(value):
+    return REAL_PATTERN.match(value) is not None
+
+
+def infer_column_type(values):
+    """
+    Infers the SQLite column type from a sample of CSV strings.
+    """
+    values = [value for value in values if value != ""]
+    if not values:
+        return "TEXT"
+    if all(_is_int(value) for value in values):
+        return "INTEGER"
+    if all(_is_float(value) for value in values):
+        return "REAL"
+    if all(DATE_PATTERN.match(value) for value in values):
+        return "DATE"
+    if all(DATETIME_PATTERN.match(value) for value in values):
+        return "DATETIME"
+    return "TEXT"
+
+
+def _converter(column_type):
+    cast = {"INTEGER": int, "REAL": float}.get(column_type)
+
+    check = {"INTEGER": _is_int, "REAL": _is_float}.get(column_type)
+
+    def convert(value):
+        if value == "":
+            return None
+        # SQLite is dynamically typed, keep values that do not fit the sample as text
+        if cast is None or not check(value):
+            return value
+        return cast(value)
+
+    return convert
+
+
+def _to_sqlite(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_csv(path, chunk_size=50000, sample_size=1000):
+    """
+    Returns (column names, column types, iterator of row chunks) for a CSV file.
+    Types are inferred from the first sample_size rows.
+    """
+    # utf-8-sig drops the byte order mark Excel writes, which would end up in the first column name
+    file = open(path, newline="", encoding="utf-8-sig")
+    reader = csv.reader(file)
+    try:
+        header = [name.strip() for name in next(reader)]
+    except StopIteration:
+        file.close()
+        raise ValueError(f"{path} is empty, expected a header row")
+    sample = list(islice(reader, sample_size))
+    column_types = [
+        infer_column_type([row[idx] for row in sample if idx < len(row)])
+        for idx in range(len(header))
+    ]
+    converters = [_converter(column_type) for column_type in column_types]
+
+    def rows():
+        with file:
+            for row in chain(sample, reader):
+                row = row + [""] * (len(header) - len(row))
+                yield tuple(convert(value) for convert, value in zip(converters, row))
+
+    return header, column_types, _chunks(rows(), chunk_size)
+
+
+def read_parquet(path, chunk_size=50000):
+    """
+    Returns (column names, column types, iterator of row chunks) for a Parquet file.
+    Requires the optional pyarrow package.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet ingestion requires the pyarrow package (pip install pyarrow)")
+
+    parquet_file = pq.ParquetFile(path)
+    column_types = []
+    for field in parquet_file.schema_arrow:
+        if pa.types.is_integer(field.type) or pa.types.is_boolean(field.type):
+            column_types.append("INTEGER")
+        elif pa.types.is_floating(field.type) or pa.types.is_decimal(field.type):
+            column_types.append("REAL")
+        elif pa.types.is_date(field.type):
+            column_types.append("DATE")
+        elif pa.types.is_timestamp(field.type):
+            column_types.append("DATETIME")
+        else:
+            column_types.append("TEXT")
+
+    def chunks():
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            columns = [column.to_pylist() for column in batch.columns]
+            yield [tuple(_to_sqlite(value) for value in row) for row in zip(*columns)]
+
+    return parquet_file.schema_arrow.names, column_types, chunks()
+
+
+def open_source(path, chunk_size=50000, sample_size=1000):
+    if Path(path).suffix.lower() in (".parquet", ".pq"):
+        return read_parquet(path, chunk_size)
+    return read_csv(path, chunk_size, sample_size)
+
+
+def create_table_statement(table_name, column_names, column_types, primary_key=None, foreign_keys=()):
+    definitions = []
+    for column_name, column_type in zip(column_names, column_types):
+        definition = f"{quote_identifier(column_name)} {column_type}"
+        if column_name == primary_key:
+            definition += " PRIMARY KEY"
+        definitions.append(definition)
+    for column_name, to_table, to_column in foreign_keys:
+        definitions.append(
+            f"FOREIGN KEY ({quote_identifier(column_name)}) "
+            f"REFERENCES {quote_identifier(to_table)}({quote_identifier(to_column)})")
+    return f"CREATE TABLE {quote_identifier(table_name)} ({', '.join(definitions)});"
+
+
+def is_key_like(column_name):
+    column_name = column_name.lower()
+    return column_name == "id" or column_name.endswith("_id")
+
+
+def create_key_indexes(cursor, table_name):
+    """
+    Indexes key-like (`id`, `*_id`) and foreign-key columns of a table.
+    Returns the names of the indexes created.
+    """
+    cursor.execute(f"PRAGMA table_info({quote_identifier(table_name)});")
+    columns = cursor.fetchall()
+    primary_keys = {column[1] for column in columns if column[5]}
+    cursor.execute(f"PRAGMA foreign_key_list({quote_identifier(table_name)});")
+    foreign_key_columns = {fk[3] for fk in cursor.fetchall()}
+
+    created = []
+    for column in columns:
+        column_name = column[1]
+        if column_name in primary_keys:
+            continue
+        if column_name in foreign_key_columns or is_key_like(column_name):
+            index_name = f"idx_{table_name}_{column_name}"
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {quote_identifier(index_name)} "
+                f"ON {quote_identifier(table_name)}({quote_identifier(column_name)});")
+            created.append(index_name)
+    return created
+
+
+def ingest_files(paths, db_path, table_names=None, chunk_size=50000, sample_size=1000,
+                 primary_keys=None, foreign_keys=None, replace=False,
+                 cell_store_path=None, cell_encoding_budget=1000):
+    """
+    Loads CSV/Parquet files into db_path, one table per file, and builds the cell store.
+
+    primary_keys maps a table to its primary key column and foreign_keys maps a
+    table to [(column, referenced table, referenced column), ...]. Existing
+    tables are appended to unless replace is set. Returns {table: rows loaded}.
+    """
+    table_names = table_names or [Path(path).stem for path in paths]
+    if len(table_names) != len(paths):
+        raise ValueError("Expected one table name per file")
+    primary_keys = primary_keys or {}
+    foreign_keys = foreign_keys or {}
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    cursor = conn.cursor()
+    journal_mode = cursor.execute("PRAGMA journal_mode;").fetchone()[0]
+    cursor.execute("PRAGMA journal_mode=WAL;").fetchone()
+    # synchronous is a per-connection setting, it ends with this connection
+    cursor.execute("PRAGMA synchronous=OFF;")
+
+    loaded = {}
+    cell_builder = CellStoreBuilder(cell_encoding_budget)
+    streamed_tables = set()
+    try:
+        for path, table_name in zip(paths, table_names):
+            column_names, column_types, chunks = open_source(path, chunk_size, sample_size)
+
+            exists = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;", (table_name,)).fetchone()
+            if exists and replace:
+                cursor.execute(f"DROP TABLE {quote_identifier(table_name)};")
+                exists = None
+            if not exists:
+                cursor.execute(create_table_statement(
+                    table_name, column_names, column_types,
+                    primary_keys.get(table_name), foreign_keys.get(table_name, ())))
+                # The cell database samples the first rows of each table, which for a
+                # new table are the first rows streamed in
+                streamed_tables.add(table_name)
+
+            insert = (f"INSERT INTO {quote_identifier(table_name)} "
+                      f"({', '.join(quote_identifier(name) for name in column_names)}) "
+                      f"VALUES ({', '.join('?' for _ in column_names)});")
+            loaded[table_name] = 0
+            for chunk in chunks:
+                cursor.execute("BEGIN;")
+                try:
+                    cursor.executemany(insert, chunk)
+                    cursor.execute("COMMIT;")
+                except sqlite3.Error:
+                    cursor.execute("ROLLBACK;")
+                    raise
+                if table_name in streamed_tables and loaded[table_name] < cell_encoding_budget:
+                    cell_builder.add_rows(
+                        table_name, column_names, chunk[:cell_encoding_budget - loaded[table_name]])
+                loaded[table_name] += len(chunk)
+                logging.info(f"Loaded {loaded[table_name]} rows into {table_name}")
+
+        for table_name in loaded:
+            indexes = create_key_indexes(cursor, table_name)
+            logging.info(f"Created indexes on {table_name}: {indexes}")
+        cursor.execute("ANALYZE;")
+    finally:
+        # Leave the file in its original journal mode so plain read-only connections work
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode};").fetchone()
+        conn.close()
+
+    if cell_store_path:
+        backend = SQLiteBackend(db_path)
+        _, _, existing_cells = build_catalog(
+            backend, cell_encoding_budget=cell_encoding_budget,
+            tables=[table_name for table_name in list_tables(backend)
+                    if table_name not in streamed_tables])
+        if existing_cells is not None:
+            cell_builder.merge(existing_cells.columns)
+        cell_db = cell_builder.build(
+            source=cell_store_source(backend.signature(), cell_encoding_budget))
+        cell_db.save(cell_store_path)
+        logging.info(f"Saved cell database to {cell_store_path} ({cell_db.memory_usage()} bytes)")
+
+    return loaded
+
+
+def _parse_column_reference(reference):
+    table_name, _, column_name = reference.rpartition(".")
+    if not table_name or not column_name:
+        raise argparse.ArgumentTypeError(f"Expected TABLE.COLUMN, got {reference!r}")
+    return table_name, column_name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Stream CSV/Parquet files into a SQLite database for TableRAG.")
+    parser.add_argument("paths", nargs="+", help="CSV or Parquet files, one table per file")
+    parser.add_argument("--db", required=True, help="SQLite database to load into")
+    parser.add_argument("--table", action="append", dest="tables",
+                        help="Table name per file (defaults to the file name)")
+    parser.add_argument("--primary-key", action="append", default=[], metavar="TABLE.COLUMN")
+    parser.add_argument("--foreign-key", action="append", default=[],
+                        metavar="TABLE.COLUMN=TABLE.COLUMN")
+    parser.add_argument("--replace", action="store_true", help="Replace existing tables")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--sample-size", type=int, default=1000,
+                        help="Rows used to infer CSV column types")
+    parser.add_argument("--cell-store", help="Write the cell database to this file")
+    parser.add_argument("--cell-encoding-budget", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    primary_keys = dict(_parse_column_reference(reference) for reference in args.primary_key)
+    foreign_keys = {}
+    for reference in args.foreign_key:
+        local, _, remote = reference.partition("=")
+        table_name, column_name = _parse_column_reference(local)
+        foreign_keys.setdefault(table_name, []).append(
+            (column_name, *_parse_column_reference(remote)))
+
+    loaded = ingest_files(
+        args.paths, args.db, table_names=args.tables, chunk_size=args.chunk_size,
+        sample_size=args.sample_size, primary_keys=primary_keys, foreign_keys=foreign_keys,
+        replace=args.replace, cell_store_path=args.cell_store,
+        cell_encoding_budget=args.cell_encoding_budget)
+    for table_name, rows in loaded.items():
+        print(f"{table_name}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
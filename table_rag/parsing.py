@@ -0,0 +1,130 @@
+"""
+Tolerant extractors for LLM replies.
+
+They accept fenced blocks with or without a language tag, unclosed fences,
+bare JSON or SQL and JSON objects wrapping the SQL, and return None (or empty
+lists) instead of raising when nothing usable is found.
+"""
+import re
+
+import json_repair
+import sqlparse
+
+FENCE_PATTERN = re.compile(r"```[ \t]*([\w+-]*)(.*?)(?:```|$)", re.DOTALL)
+SQL_START_PATTERN = re.compile(r"\b(?:WITH|SELECT)\b", re.IGNORECASE)
+# Unfenced SQL must start a line or follow a colon, and be all upper or lower
+# case, so prose such as "I would select the rows where..." is not taken for it
+BARE_SQL_START_PATTERN = re.compile(r"(?:^|:)[ \t]*(WITH|SELECT|with|select)\b", re.MULTILINE)
+SQL_KEYS = ("sql", "sql_query", "query")
+
+
+def code_blocks(text):
+    """
+    Returns [(language, body), ...] for the fenced blocks of a reply, including
+    a trailing unclosed one. The language is "" when the fence has no tag.
+    """
+    blocks = []
+    for language, body in FENCE_PATTERN.findall(text or ""):
+        # ```SELECT ...``` has no language tag, the first word is part of the query
+        if SQL_START_PATTERN.fullmatch(language):
+            language, body = "", language + body
+        blocks.append((language.lower(), body.strip()))
+    return blocks
+
+
+def extract_json(text):
+    """
+    Returns the first JSON object in a reply, or None.
+    """
+    if isinstance(text, dict):
+        return text
+    blocks = code_blocks(text)
+    candidates = [body for language, body in blocks if language == "json"]
+    candidates += [body for language, body in blocks if language != "json"]
+    text = text or ""
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1:
+        candidates.append(text[start:end + 1] if end > start else text[start:])
+
+    for candidate in candidates:
+        try:
+            data = json_repair.loads(candidate)
+        except Exception:
+            continue
+        if isinstance(data, list):
+            data = next((item for item in data if isinstance(item, dict)), None)
+        if isinstance(data, dict) and data:
+            return data
+    return None
+
+
+def _string_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (str, int, float)):
+        return [str(value)]
+    if isinstance(value, dict):
+        return _string_list(list(value.values()))
+    strings = []
+    for item in value:
+        strings += _string_list(item)
+    return strings
+
+
+def _column_name(column):
+    # "payroll.hourly_rate" or "`hourly_rate`" -> hourly_rate
+    return column.rpartition(".")[2].strip(" \"'`[]")
+
+
+def parse_expansion(reply):
+    """
+    Returns (columns, cell values) from a query expansion reply (text or parsed
+    JSON), or two empty lists if none can be found.
+    """
+    data = extract_json(reply) or {}
+    columns = _string_list(data.get("columns", data.get("relevant_columns")))
+    cell_values = _string_list(data.get(
+        "cell_values", data.get("possible_cell_values", data.get("values"))))
+    columns = [_column_name(column) for column in columns if _column_name(column)]
+    return list(dict.fromkeys(columns)), list(dict.fromkeys(cell_values))
+
+
+def _clean_sql(sql_query):
+    sql_query = sql_query.strip().strip("`").strip()
+    return sql_query or None
+
+
+def _bare_sql(text):
+    match = BARE_SQL_START_PATTERN.search(text)
+    if not match:
+        return None
+    # Stop at the end of the first statement (a ; outside quotes), commentary often follows
+    statements = sqlparse.split(text[match.start(1):])
+    return _clean_sql(statements[0]) if statements else None
+
+
+def extract_sql(reply):
+    """
+    Returns the SQL query of a reply (text or parsed JSON), or None.
+    """
+    if isinstance(reply, dict):
+        sql_query = next((reply[key] for key in SQL_KEYS if isinstance(reply.get(key), str)), None)
+        return _clean_sql(sql_query) if sql_query else None
+    if not reply:
+        return None
+
+    blocks = code_blocks(reply)
+    for language, body in blocks:
+        if language in ("sql", "sqlite", "sqlite3", "duckdb") and body:
+            return _clean_sql(body)
+
+    if '"sql' in reply or '"query' in reply:
+        sql_query = extract_sql(extract_json(reply) or {})
+        if sql_query:
+            return sql_query
+
+    for language, body in blocks:
+        if language != "json" and SQL_START_PATTERN.match(body):
+            return _clean_sql(body)
+
+    return _bare_sql(reply)
@@ -0,0 +1,292 @@
+import logging
+import math
+import re
+from collections import Counter
+
+# Prefix of the indexes created by IndexAdvisor, so they can be listed and dropped
+MANAGED_INDEX_PREFIX = "tablerag_idx_"
+
+TABLE_REFERENCE_PATTERN = re.compile(
+    r'\b(?:FROM|JOIN)\s+["`\[]?(\w+)["`\]]?(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+COMMA_TABLE_PATTERN = re.compile(
+    r',\s*["`\[]?(\w+)\b["`\]]?(?!\s*[.(])(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+PREDICATE_PATTERN = re.compile(
+    r'\b(\w+)\.(\w+)\s*(?:=|<|>|\bIN\b|\bBETWEEN\b|\bLIKE\b)', re.IGNORECASE)
+# The right-hand side of a comparison, as in "ON e.employee_id = s.employee_id"
+RIGHT_PREDICATE_PATTERN = re.compile(r'[=<>]\s*(\w+)\.(\w+)\b(?!\s*\()')
+BARE_PREDICATE_PATTERN = re.compile(
+    r'(?<![.\w])(\w+)\s*(?:=|<|>|\bIN\b|\bBETWEEN\b|\bLIKE\b)', re.IGNORECASE)
+BARE_RIGHT_PREDICATE_PATTERN = re.compile(r'[=<>]\s*(\w+)\b(?!\s*[.(])')
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+LEADING_WILDCARD_PATTERN = re.compile(r"\bI?LIKE\s+'%", re.IGNORECASE)
+# "SCAN s" (SQLite >= 3.36) or "SCAN TABLE Sales AS s" (older releases)
+PLAN_STEP_PATTERN = re.compile(
+    r'^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\S+)(?:\s+AS\s+(\S+))?(?:\s+USING\s+(.*?))?(?:\s+\((.*)\))?$')
+
+SQL_KEYWORDS = {
+    "where", "join", "inner", "left", "right", "full", "outer", "cross", "natural",
+    "on", "using", "group", "order", "limit", "having", "union", "except",
+    "intersect", "window", "as", "select", "set", "values",
+}
+
+
+class QueryPlanError(ValueError):
+    """
+    Raised when the estimated cost of a query plan exceeds the configured limit.
+    """
+
+
+def table_aliases(sql_query):
+    """
+    Maps the aliases (and names) used in FROM/JOIN clauses to table names.
+    """
+    aliases = {}
+    for table_name, alias in TABLE_REFERENCE_PATTERN.findall(sql_query):
+        aliases[table_name] = table_name
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[alias] = table_name
+    # Comma joins (FROM a x, b y); never override an alias found above
+    for table_name, alias in COMMA_TABLE_PATTERN.findall(sql_query):
+        aliases.setdefault(table_name, table_name)
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases.setdefault(alias, table_name)
+    return aliases
+
+
+def predicate_columns(sql_query, aliases, table_columns):
+    """
+    Maps table names to the columns compared in a query, on either side of the
+    operator. Unqualified columns are resolved when the query reads a single
+    table; table_columns(table) returns {lowercase name: name} for it.
+    """
+    sql_query = STRING_LITERAL_PATTERN.sub("''", sql_query)
+    predicates = {}
+    for pattern in (PREDICATE_PATTERN, RIGHT_PREDICATE_PATTERN):
+        for alias, column_name in pattern.findall(sql_query):
+            if alias in aliases:
+                predicates.setdefault(aliases[alias], set()).add(column_name)
+
+    tables = set(aliases.values())
+    if len(tables) == 1:
+        table_name = tables.pop()
+        columns = table_columns(table_name)
+        for pattern in (BARE_PREDICATE_PATTERN, BARE_RIGHT_PREDICATE_PATTERN):
+            for column_name in pattern.findall(sql_query):
+                if column_name.lower() in columns:
+                    predicates.setdefault(table_name, set()).add(columns[column_name.lower()])
+    return predicates
+
+
+class QueryPlanner:
+    """
+    Estimates the cost of a query from its query plan (EXPLAIN QUERY PLAN) and the
+    size of the tables it touches, and records which tables are scanned on which
+    columns so IndexAdvisor can suggest indexes for recurring patterns.
+
+    The cost is a rough number of rows visited: a full scan visits every row of
+    the table once per row of the enclosing loop, an index search log2(rows), an
+    automatic index costs a sort of the table. A correlated subquery runs once per
+    row of the loop it appears in, other subqueries once. Only the avoidable part
+    of the cost is held against max_plan_cost: full scans inside nested loops or
+    correlated subqueries and, with a leading-wildcard LIKE, the outer scans. A
+    single full scan plus a GROUP BY sort, or an automatic index, is what the query
+    needs without a better index and is left to IndexAdvisor instead of rejected.
+    """
+
+    def __init__(self, backend, max_plan_cost=10_000_000, default_rows=1000):
+        self.backend = backend
+        self.max_plan_cost = max_plan_cost
+        self.default_rows = default_rows
+        self.scan_patterns = Counter()
+        self._statistics = {"signature": None, "rows": {}, "columns": {}}
+
+    def statistics(self):
+        """
+        Returns the cached table statistics, dropped whenever the database changes.
+        """
+        # Queries run on several threads: callers keep the dict they got even if
+        # another thread replaces it meanwhile
+        statistics = self._statistics
+        signature = self.backend.signature()
+        if statistics["signature"] != signature:
+            statistics = {"signature": signature, "rows": {}, "columns": {}}
+            self._statistics = statistics
+        return statistics
+
+    def row_count(self, table_name):
+        row_counts = self.statistics()["rows"]
+        if table_name not in row_counts:
+            rows = self.backend.estimate_rows(table_name)
+            row_counts[table_name] = self.default_rows if rows is None else rows
+        return row_counts[table_name]
+
+    def table_columns(self, table_name):
+        """
+        Returns {lowercase column name: column name} for a table, empty if unknown.
+        """
+        table_columns = self.statistics()["columns"]
+        if table_name not in table_columns:
+            conn = self.backend.connect()
+            try:
+                columns = self.backend.table_columns(conn.cursor(), table_name)
+            except self.backend.error_types:
+                columns = []
+            finally:
+                conn.close()
+            table_columns[table_name] = {name.lower(): name for name, _ in columns}
+        return table_columns[table_name]
+
+    def analyze(self, sql_query):
+        """
+        Returns {"cost", "avoidable_cost", "steps", "warnings", "patterns"} for a
+        query, or None if the backend cannot explain queries.
+        """
+        plan = self.backend.explain(sql_query)
+        if plan is None:
+            return None
+
+        aliases = table_aliases(sql_query)
+        predicates = predicate_columns(sql_query, aliases, self.table_columns)
+
+        cost = 0
+        avoidable_cost = 0
+        outer_scan_cost = 0
+        steps = []
+        warnings = []
+        patterns = []
+        # Loops with the same parent are nested in plan order; loop_rows holds the
+        # rows of the innermost loop so far, start_rows how often a node runs
+        loop_rows = {}
+        start_rows = {}
+        for step_id, parent_id, _, detail in plan:
+            outer_rows = loop_rows.get(parent_id, start_rows.get(parent_id, 1))
+            match = PLAN_STEP_PATTERN.match(detail)
+            if not match:
+                if detail.startswith("USE TEMP B-TREE"):
+                    step_cost = outer_rows * math.log2(outer_rows + 1)
+                    cost += step_cost
+                    steps.append({"detail": detail, "cost": step_cost})
+                elif detail.startswith("CORRELATED"):
+                    # Runs once per row of the loop it appears in
+                    start_rows[step_id] = outer_rows
+                elif "SUBQUERY" in detail or detail.startswith(("MATERIALIZE", "CO-ROUTINE")):
+                    start_rows[step_id] = 1
+                else:
+                    # MULTI-INDEX OR, compound query parts
+                    start_rows[step_id] = start_rows.get(parent_id, 1)
+                continue
+
+            operation, name, alias, index, constraint = match.groups()
+            alias = alias or name
+            table_name = aliases.get(alias, name)
+            rows = self.row_count(table_name)
+
+            if operation == "SCAN":
+                step_cost = outer_rows * rows
+                loop_rows[parent_id] = outer_rows * rows
+                if outer_rows > 1:
+                    avoidable_cost += step_cost
+                    warnings.append(f"Full scan of {table_name} ({rows} rows) inside a "
+                                    f"nested loop or correlated subquery")
+                else:
+                    outer_scan_cost += step_cost
+                columns = tuple(sorted(predicates.get(table_name, ())))
+                if columns:
+                    patterns.append((table_name, columns))
+            elif index and index.startswith("AUTOMATIC"):
+                # SQLite builds a temporary index on every execution, a sort the
+                # query cannot avoid without a real index
+                step_cost = rows * math.log2(rows + 1) + outer_rows * math.log2(rows + 1)
+                loop_rows[parent_id] = outer_rows
+                columns = tuple(sorted(re.findall(r"(\w+)\s*[=<>]", constraint or "")))
+                warnings.append(
+                    f"No index on {table_name}({', '.join(columns)}), SQLite builds a temporary one")
+                if columns:
+                    patterns.append((table_name, columns))
+            else:
+                step_cost = outer_rows * math.log2(rows + 1)
+                loop_rows[parent_id] = outer_rows
+
+            cost += step_cost
+            steps.append({"detail": detail, "table": table_name,
+                         "rows": rows, "cost": step_cost})
+
+        if LEADING_WILDCARD_PATTERN.search(sql_query):
+            avoidable_cost += outer_scan_cost
+            warnings.append("LIKE with a leading '%' cannot use an index")
+
+        return {"cost": cost, "avoidable_cost": avoidable_cost, "steps": steps,
+                "warnings": warnings, "patterns": patterns}
+
+    def check(self, sql_query):
+        """
+        Analyzes a query, records its scan patterns and raises QueryPlanError if its
+        avoidable cost is too high.
+        """
+        analysis = self.analyze(sql_query)
+        if analysis is None:
+            return None
+
+        self.scan_patterns.update(analysis["patterns"])
+        logging.debug(
+            f"Estimated query cost {analysis['cost']:.0f}: {analysis['warnings']}")
+
+        if self.max_plan_cost is not None and analysis["avoidable_cost"] > self.max_plan_cost:
+            raise QueryPlanError(
+                f"Query plan is too expensive (estimated {analysis['avoidable_cost']:.0f} avoidable "
+                f"rows visited, limit {self.max_plan_cost}). " +
+                "".join(f"{warning}. " for warning in analysis["warnings"]) +
+                "Rewrite the query to filter on indexed columns, join on keys and avoid "
+                "leading wildcards in LIKE.")
+        return analysis
+
+
+class IndexAdvisor:
+    """
+    Suggests indexes for the (table, columns) scan patterns a QueryPlanner has
+    seen at least min_occurrences times, and optionally creates them. Created
+    indexes are named with MANAGED_INDEX_PREFIX so they can be dropped again.
+    """
+
+    def __init__(self, planner, min_occurrences=3, max_indexes=10):
+        self.planner = planner
+        self.min_occurrences = min_occurrences
+        self.max_indexes = max_indexes
+
+    def suggestions(self):
+        """
+        Returns [(table, columns, CREATE INDEX statement), ...], most frequent pattern first.
+        """
+        backend = self.planner.backend
+        suggestions = []
+        for (table_name, columns), count in self.planner.scan_patterns.most_common():
+            if count < self.min_occurrences:
+                break
+            if backend.has_index(table_name, columns):
+                continue
+            index_name = f"{MANAGED_INDEX_PREFIX}{table_name}_{'_'.join(columns)}"
+            statement = (f'CREATE INDEX IF NOT EXISTS "{index_name}" '
+                         f'ON "{table_name}" ({", ".join(columns)});')
+            suggestions.append((table_name, columns, statement))
+        return suggestions
+
+    def managed_indexes(self):
+        return [index_name for index_name in self.planner.backend.list_indexes()
+                if index_name.startswith(MANAGED_INDEX_PREFIX)]
+
+    def apply(self):
+        """
+        Creates the suggested indexes, up to max_indexes managed indexes in total.
+        """
+        room = self.max_indexes - len(self.managed_indexes())
+        created = []
+        for table_name, columns, statement in self.suggestions()[:max(room, 0)]:
+            self.planner.backend.execute_script(statement)
+            logging.info(f"Created index on {table_name}({', '.join(columns)})")
+            created.append(statement)
+        return created
+
+    def drop_managed(self):
+        for index_name in self.managed_indexes():
+            self.planner.backend.execute_script(f'DROP INDEX IF EXISTS "{index_name}";')
+            logging.info(f"Dropped index {index_name}")
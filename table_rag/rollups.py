@@ -0,0 +1,635 @@
+import concurrent.futures
+import json
+import logging
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from table_rag.planner import table_aliases
+
+# Name the sidecar database is attached under on every connection
+ROLLUP_SCHEMA = "rollups"
+# Table in the main database counting updates and deletes per base table, and the
+# prefix of the triggers that maintain it
+CHANGES_TABLE = "tablerag_changes"
+
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+AGGREGATE_PATTERN = re.compile(
+    r"\b(SUM|AVG|COUNT|MIN|MAX|TOTAL)\s*\(\s*(DISTINCT\s+)?((?:[^()]|\([^()]*\))*)\)", re.IGNORECASE)
+COLUMN_ALIAS_PATTERN = re.compile(r'\bAS\s+("[^"]*"|\w+)', re.IGNORECASE)
+QUOTED_ALIAS_PATTERN = re.compile(r'\bAS\s+"(?:[^"]|"")*"', re.IGNORECASE)
+SLOT_PATTERN = re.compile(r"\x00(\d+)\x00")
+SELECT_LIST_PATTERN = re.compile(r"\bSELECT\s+(DISTINCT\s+)?(.*?)\s+FROM\b", re.IGNORECASE | re.DOTALL)
+# "expr AS name", "expr AS \"name\"" or "expr name" at the end of a SELECT item
+ITEM_ALIAS_PATTERN = re.compile(
+    r'^(?P<expression>.*?[\w)"\'\]])\s+(?:AS\s+)?(?P<name>"(?:[^"]|"")*"|\w+)\s*$',
+    re.IGNORECASE | re.DOTALL)
+# Words that are never an alias ("x IS NULL", "CASE ... END") and operators that
+# take the following word as their operand ("x LIKE y")
+NON_ALIAS_WORDS = {"distinct", "end", "null"}
+OPERATOR_WORDS = {
+    "and", "between", "collate", "else", "escape", "glob", "in", "is", "like", "not",
+    "or", "regexp", "then", "when",
+}
+OUTER_JOIN_PATTERN = re.compile(r"\b(?:RIGHT|FULL)\s+(?:OUTER\s+)?JOIN\b", re.IGNORECASE)
+
+AGGREGATE_COLUMNS = ("sum", "count", "min", "max")
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _normalize(expression):
+    return re.sub(r"\s+", " ", expression.strip())
+
+
+class _QueryShape:
+    """
+    A single-table view of an aggregate query: the query text with every
+    reference to the base table replaced by a slot, plus what each slot holds.
+
+    Slots are ("table", keyword), ("dim", dim), ("agg", function, measure),
+    ("other_agg", function, distinct, text) or ("raw", text). A dim is ("column", name)
+    or ("strftime", format literal, name); a measure is the normalized
+    aggregate argument, or "*" for COUNT(*).
+    """
+
+    def __init__(self, sql_query, table_name, alias, table_columns, other_columns, other_aliases):
+        # On the nullable side of an outer join, groups without a match would
+        # read NULL row counts instead of counting the NULL-extended row
+        if OUTER_JOIN_PATTERN.search(sql_query) or re.search(
+                r'\bLEFT\s+(?:OUTER\s+)?JOIN\s+["`\[]?%s\b' % re.escape(table_name),
+                sql_query, re.IGNORECASE):
+            raise _Unsupported("base table on the nullable side of an outer join")
+
+        self.table_name = table_name
+        self.alias = alias
+        self.slots = []
+        self.dims = set()
+        self.measures = set()
+
+        qualifiers = "|".join(re.escape(name) for name in {alias, table_name})
+        owned = [column for column in table_columns if column not in other_columns]
+        # Qualified references may name any column, bare names only unambiguous ones
+        qualified = r'(?<![\w.])(?:%s)\.(?P<quote>"?)(?P<column>%s)(?P=quote)(?![\w"(])' % (
+            qualifiers, "|".join(re.escape(column) for column in table_columns) or "(?!)")
+        bare = r'(?<![\w."])(?P<quote>"?)(?P<column>%s)(?P=quote)(?![\w"(])' % (
+            "|".join(re.escape(column) for column in owned) or "(?!)")
+        self._references = [qualified, bare]
+        self._other_qualifiers = re.compile(
+            r"(?<![\w.])(?:%s)\." % "|".join(re.escape(name) for name in other_aliases)
+            if other_aliases else "(?!)")
+
+        # A bare name after the SELECT list that is also an output alias (ORDER BY
+        # quantity for SUM(quantity) AS quantity) may mean the alias, not the column
+        select_list = SELECT_LIST_PATTERN.search(sql_query)
+        shadowed = [name for name, expression in output_aliases(sql_query).items()
+                    if name in owned and not re.fullmatch(
+                        r'(?:\w+\.)?"?%s"?' % re.escape(name), expression)]
+        if shadowed and select_list and re.search(
+                r'(?<![\w."])"?(?:%s)"?(?![\w"(])' % "|".join(re.escape(name) for name in shadowed),
+                sql_query[select_list.end(2):]):
+            raise _Unsupported("output alias shadows a column of the base table")
+
+        text = sql_query
+        # The FROM/JOIN reference to the base table
+        text = re.sub(
+            r'\b(FROM|JOIN)\s+["`\[]?%s\b["`\]]?(?:\s+(?:AS\s+)?%s\b)?' % (
+                re.escape(table_name), re.escape(alias)),
+            lambda match: self._slot(("table", match.group(1))), text, count=1, flags=re.IGNORECASE)
+
+        text = QUOTED_ALIAS_PATTERN.sub(lambda match: self._slot(("raw", match.group(0))), text)
+        text = AGGREGATE_PATTERN.sub(self._aggregate, text)
+        for reference in self._references:
+            text = re.sub(
+                r"\bstrftime\s*\(\s*('(?:[^']|'')*')\s*,\s*%s\s*\)" % reference,
+                lambda match: self._dim(("strftime", match.group(1), match.group("column"))),
+                text, flags=re.IGNORECASE)
+        text = STRING_LITERAL_PATTERN.sub(lambda match: self._slot(("raw", match.group(0))), text)
+        text = COLUMN_ALIAS_PATTERN.sub(lambda match: self._slot(("raw", match.group(0))), text)
+        for reference in self._references:
+            text = re.sub(reference, lambda match: self._dim(("column", match.group("column"))), text)
+
+        # Anything still pointing at the base table cannot be rewritten
+        if re.search(r"(?<![\w.])(?:%s)\.(\w+|\*)" % qualifiers, text):
+            raise _Unsupported("unsupported reference to the base table")
+        if re.search(r"\bSELECT\s+(DISTINCT\s+)?\*", text, re.IGNORECASE):
+            raise _Unsupported("SELECT *")
+        self.template = text
+
+    def _slot(self, slot):
+        self.slots.append(slot)
+        return f"\x00{len(self.slots) - 1}\x00"
+
+    def _dim(self, dim):
+        self.dims.add(dim)
+        return self._slot(("dim", dim))
+
+    def _aggregate(self, match):
+        function, distinct, argument = match.group(1).upper(), match.group(2), match.group(3)
+        if argument.strip() == "*":
+            self.measures.add("*")
+            return self._slot(("agg", function, "*"))
+        if not any(re.search(reference, argument) for reference in self._references):
+            return self._slot(("other_agg", function, bool(distinct), match.group(0)))
+        if distinct:
+            raise _Unsupported("DISTINCT aggregate on the base table")
+        if self._other_qualifiers.search(argument):
+            raise _Unsupported("aggregate mixes columns of several tables")
+        measure = argument
+        for reference in self._references:
+            measure = re.sub(reference, lambda column: f'"{column.group("column")}"', measure)
+        measure = _normalize(measure)
+        self.measures.add(measure)
+        return self._slot(("agg", function, measure))
+
+
+def _split_top_level(text):
+    items, depth, start, quote = [], 0, 0, None
+    for idx, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(text[start:idx])
+            start = idx + 1
+    items.append(text[start:])
+    return items
+
+
+def _item_alias(item):
+    match = ITEM_ALIAS_PATTERN.match(item.strip())
+    if not match or match.group("name").lower() in NON_ALIAS_WORDS:
+        return None
+    last_word = re.search(r"(\w+)\W*$", match.group("expression"))
+    if not match.group(0)[len(match.group("expression")):].lstrip().upper().startswith("AS") \
+            and last_word and last_word.group(1).lower() in OPERATOR_WORDS:
+        return None
+    return match.group("expression"), match.group("name").strip('"').replace('""', '"')
+
+
+def output_aliases(sql_query):
+    """
+    Maps the aliased result columns of the SELECT list to their expressions.
+    """
+    match = SELECT_LIST_PATTERN.search(sql_query)
+    if not match:
+        return {}
+    aliases = {}
+    for item in _split_top_level(match.group(2)):
+        aliased = _item_alias(item)
+        if aliased:
+            expression, name = aliased
+            aliases[name] = expression.strip()
+    return aliases
+
+
+def explicit_column_names(sql_query):
+    """
+    Adds an alias to every unaliased SELECT item, so a rewritten query keeps
+    the result column names of the original.
+    """
+    match = SELECT_LIST_PATTERN.search(sql_query)
+    if not match:
+        return sql_query
+    items = []
+    for item in _split_top_level(match.group(2)):
+        stripped = item.strip()
+        if _item_alias(stripped) or stripped.endswith("*"):
+            items.append(item)
+            continue
+        column = re.fullmatch(r'(?:\w+\.)?"?(\w+)"?', stripped)
+        name = column.group(1) if column else stripped
+        items.append(f' {stripped} AS "{name.replace(chr(34), chr(34) * 2)}"')
+    return (sql_query[:match.start(2)] + ",".join(items).strip()
+            + sql_query[match.end(2):])
+
+
+def parse_query_shapes(sql_query, schema):
+    """
+    Returns a _QueryShape for every schema table the query aggregates over.
+    Only single-SELECT queries with GROUP BY are considered.
+    """
+    if len(re.findall(r"\bSELECT\b", sql_query, re.IGNORECASE)) != 1:
+        return []
+    if not re.search(r"\bGROUP\s+BY\b", sql_query, re.IGNORECASE) or \
+            re.search(r"\bOVER\s*\(", sql_query, re.IGNORECASE):
+        return []
+
+    aliases = table_aliases(sql_query)
+    tables = {table_name for table_name in aliases.values() if table_name in schema}
+    shapes = []
+    for table_name in tables:
+        table_aliases_ = [alias for alias, name in aliases.items()
+                          if name == table_name and alias != table_name]
+        if len(table_aliases_) > 1:
+            continue  # self joins
+        alias = table_aliases_[0] if table_aliases_ else table_name
+        table_columns = [column["name"] for column in schema[table_name]["columns"]]
+        other_columns = {column["name"]
+                         for other in tables if other != table_name
+                         for column in schema[other]["columns"]}
+        other_aliases = [name for name, table in aliases.items() if table != table_name]
+        try:
+            shape = _QueryShape(sql_query, table_name, alias, table_columns,
+                                other_columns, other_aliases)
+        except _Unsupported as e:
+            logging.debug(f"Query shape on {table_name} not supported: {e}")
+            continue
+        # Aggregates over joined tables only survive grouping if they ignore duplicates
+        if shape.measures and not any(
+                slot[0] == "other_agg" and not slot[2] and slot[1] not in ("MIN", "MAX")
+                for slot in shape.slots):
+            shapes.append(shape)
+    return shapes
+
+
+def dim_expression(dim):
+    if dim[0] == "strftime":
+        return f'strftime({dim[1]}, "{dim[2]}")'
+    return f'"{dim[1]}"'
+
+
+class RollupCache:
+    """
+    Materialized summary tables for recurring GROUP BY query shapes.
+
+    Executed queries are mined with record(); once a shape (base table, group
+    keys, aggregated expressions) has been seen min_occurrences times, a rollup
+    grouped by those keys is built in a sidecar SQLite database. rewrite()
+    transparently points matching queries at the smallest covering rollup and
+    re-aggregates it (SUM of sums, SUM of counts, ...).
+
+    Builds and refreshes run on a background thread, never on the query path.
+    Each base table with a rollup gets UPDATE and DELETE triggers that bump its
+    version in CHANGES_TABLE. A rollup is current while the version and MAX(rowid)
+    of its table match the ones it was built from; rewrite() skips stale rollups
+    and queues their refresh. Rows appended past the last seen rowid are merged
+    in, any update or delete rebuilds the rollups of that table only. Rows
+    replaced by INSERT OR REPLACE fire no delete trigger (unless
+    recursive_triggers is on); call refresh(full=True) after them.
+    """
+
+    def __init__(self, db_path, rollup_path, schema, min_occurrences=2,
+                 max_group_ratio=0.5, max_rollups=20):
+        self.db_path = db_path
+        self.rollup_path = rollup_path
+        self.schema = schema
+        self.min_occurrences = min_occurrences
+        self.max_group_ratio = max_group_ratio
+        self.max_rollups = max_rollups
+
+        self.shape_counts = {}
+        self._rejected = set()
+        # Tasks queued on the worker, by key, so each is only queued once
+        self._pending = {}
+        self._lock = threading.RLock()
+        # The query path only reads through _conn; the worker builds through its own connection
+        self._conn = self._connect()
+        self._conn.execute(f"PRAGMA {ROLLUP_SCHEMA}.journal_mode=WAL;")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {ROLLUP_SCHEMA}.rollup_catalog ("
+            "name TEXT PRIMARY KEY, base_table TEXT, dims TEXT, measures TEXT, "
+            "last_rowid INTEGER, group_count INTEGER, change_version INTEGER);")
+        catalog_columns = [row[1] for row in self._conn.execute(
+            f"PRAGMA {ROLLUP_SCHEMA}.table_info(rollup_catalog);").fetchall()]
+        if "change_version" not in catalog_columns:
+            # Sidecars written before change tracking are rebuilt on first use
+            self._conn.execute(
+                f"ALTER TABLE {ROLLUP_SCHEMA}.rollup_catalog ADD COLUMN change_version INTEGER;")
+        self._worker_conn = self._connect()
+        self._worker = ThreadPoolExecutor(1, thread_name_prefix="table-rag-rollups")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute(f"ATTACH DATABASE ? AS {ROLLUP_SCHEMA};", (self.rollup_path,))
+        return conn
+
+    def close(self):
+        self._worker.shutdown(wait=True, cancel_futures=True)
+        self._conn.close()
+        self._worker_conn.close()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the queued builds and refreshes have finished.
+        """
+        with self._lock:
+            futures = list(self._pending.values())
+        concurrent.futures.wait(futures, timeout)
+
+    def _submit(self, key, function, *args):
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            future = self._worker.submit(self._run, key, function, *args)
+            self._pending[key] = future
+            return future
+
+    def _run(self, key, function, *args):
+        try:
+            function(*args)
+        except sqlite3.Error as e:
+            logging.error(f"Rollup task {key[0]} on {key[1]} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def rollups(self, conn=None):
+        with self._lock:
+            rows = (conn or self._conn).execute(
+                f"SELECT name, base_table, dims, measures, last_rowid, group_count, change_version "
+                f"FROM {ROLLUP_SCHEMA}.rollup_catalog ORDER BY group_count;").fetchall()
+        return [
+            {
+                "name": name,
+                "base_table": base_table,
+                "dims": [tuple(dim) for dim in json.loads(dims)],
+                "measures": json.loads(measures),
+                "last_rowid": last_rowid,
+                "group_count": group_count,
+                "change_version": change_version,
+            }
+            for name, base_table, dims, measures, last_rowid, group_count, change_version in rows
+        ]
+
+    def _select(self, base_table, dims, measures, where=None):
+        columns = [f"{dim_expression(dim)} AS d{idx}" for idx, dim in enumerate(dims)]
+        columns.append("COUNT(*) AS row_count")
+        for idx, measure in enumerate(measures):
+            columns += [f"{function.upper()}({measure}) AS {function}_m{idx}"
+                        for function in AGGREGATE_COLUMNS]
+        group_by = ", ".join(f"d{idx}" for idx in range(len(dims)))
+        return (f'SELECT {", ".join(columns)} FROM main."{base_table}"'
+                + (f" WHERE {where}" if where else "")
+                + (f" GROUP BY {group_by}" if group_by else ""))
+
+    def _table_state(self, conn, base_table):
+        """
+        Returns (MAX(rowid), change version) of a base table. The version is None
+        while the table has no change triggers.
+        """
+        max_rowid = conn.execute(f'SELECT MAX(rowid) FROM main."{base_table}";').fetchone()[0] or 0
+        try:
+            row = conn.execute(
+                f"SELECT version, (SELECT COUNT(*) FROM main.sqlite_master WHERE type = 'trigger' "
+                f"AND tbl_name = ? AND name LIKE '{CHANGES_TABLE}\\_%' ESCAPE '\\') "
+                f"FROM main.{CHANGES_TABLE} WHERE table_name = ?;",
+                (base_table, base_table)).fetchone()
+        except sqlite3.OperationalError:
+            return max_rowid, None
+        # Dropping the table drops its triggers too
+        return max_rowid, row[0] if row and row[1] == 2 else None
+
+    def _track_changes(self, base_table):
+        """
+        Creates the triggers that bump the version of a base table in CHANGES_TABLE.
+        """
+        conn = self._worker_conn
+        if self._table_state(conn, base_table)[1] is not None:
+            return
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS main.{CHANGES_TABLE} "
+                         "(table_name TEXT PRIMARY KEY, version INTEGER NOT NULL);")
+            conn.execute(f"INSERT OR IGNORE INTO main.{CHANGES_TABLE} VALUES (?, 0);", (base_table,))
+            literal = base_table.replace("'", "''")
+            for event in ("UPDATE", "DELETE"):
+                conn.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS main."{CHANGES_TABLE}_{base_table}_{event.lower()}" '
+                    f'AFTER {event} ON "{base_table}" BEGIN '
+                    f"UPDATE {CHANGES_TABLE} SET version = version + 1 WHERE table_name = '{literal}'; END;")
+            conn.execute("COMMIT;")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK;")
+            raise
+
+    def _build(self, name, base_table, dims, measures):
+        conn = self._worker_conn
+        self._track_changes(base_table)
+        conn.execute("BEGIN;")
+        try:
+            # Read inside the transaction so the state matches the rows aggregated
+            last_rowid, change_version = self._table_state(conn, base_table)
+            conn.execute(f'DROP TABLE IF EXISTS {ROLLUP_SCHEMA}."{name}";')
+            conn.execute(
+                f'CREATE TABLE {ROLLUP_SCHEMA}."{name}" AS '
+                + self._select(base_table, dims, measures, f"rowid <= {last_rowid}") + ";")
+            group_count = conn.execute(
+                f'SELECT COUNT(*) FROM {ROLLUP_SCHEMA}."{name}";').fetchone()[0]
+            conn.execute(
+                f"INSERT OR REPLACE INTO {ROLLUP_SCHEMA}.rollup_catalog VALUES (?, ?, ?, ?, ?, ?, ?);",
+                (name, base_table, json.dumps(dims), json.dumps(measures), last_rowid, group_count,
+                 change_version))
+            conn.execute("COMMIT;")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK;")
+            raise
+        logging.info(f"Built rollup {name} on {base_table} ({group_count} groups)")
+
+    def _merge(self, rollup, last_rowid):
+        conn = self._worker_conn
+        name, dims, measures = rollup["name"], rollup["dims"], rollup["measures"]
+        delta = self._select(rollup["base_table"], dims, measures,
+                             f"rowid > {rollup['last_rowid']} AND rowid <= {last_rowid}")
+        columns = ["row_count"] + [f"{function}_m{idx}" for idx in range(len(measures))
+                                   for function in AGGREGATE_COLUMNS]
+        merged = [f"d{idx}" for idx in range(len(dims))] + [
+            f"{'MIN' if column.startswith('min_') else 'MAX' if column.startswith('max_') else 'SUM'}"
+            f"({column}) AS {column}" for column in columns]
+        group_by = ", ".join(f"d{idx}" for idx in range(len(dims)))
+
+        conn.execute("BEGIN;")
+        try:
+            conn.execute(
+                f'CREATE TABLE {ROLLUP_SCHEMA}."{name}_merge" AS SELECT {", ".join(merged)} '
+                f'FROM (SELECT * FROM {ROLLUP_SCHEMA}."{name}" UNION ALL {delta})'
+                + (f" GROUP BY {group_by}" if group_by else "") + ";")
+            conn.execute(f'DROP TABLE {ROLLUP_SCHEMA}."{name}";')
+            conn.execute(
+                f'ALTER TABLE {ROLLUP_SCHEMA}."{name}_merge" RENAME TO "{name}";')
+            group_count = conn.execute(
+                f'SELECT COUNT(*) FROM {ROLLUP_SCHEMA}."{name}";').fetchone()[0]
+            conn.execute(
+                f"UPDATE {ROLLUP_SCHEMA}.rollup_catalog SET last_rowid = ?, group_count = ? "
+                f"WHERE name = ?;", (last_rowid, group_count, name))
+            conn.execute("COMMIT;")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK;")
+            raise
+        logging.debug(f"Merged rows up to {last_rowid} into rollup {name}")
+
+    def _refresh_table(self, base_table, full=False):
+        conn = self._worker_conn
+        last_rowid, change_version = self._table_state(conn, base_table)
+        for rollup in self.rollups(conn):
+            if rollup["base_table"] != base_table:
+                continue
+            if full or change_version is None or rollup["change_version"] != change_version:
+                # Rows were updated or deleted in place
+                self._build(rollup["name"], base_table, rollup["dims"], rollup["measures"])
+            elif last_rowid > rollup["last_rowid"]:
+                self._merge(rollup, last_rowid)
+
+    def refresh(self, full=False):
+        """
+        Brings every rollup up to date with its base table and waits for it.
+        """
+        futures = [self._submit(("refresh", base_table), self._refresh_table, base_table, full)
+                   for base_table in {rollup["base_table"] for rollup in self.rollups()}]
+        concurrent.futures.wait(futures)
+
+    def _is_current(self, rollup):
+        with self._lock:
+            last_rowid, change_version = self._table_state(self._conn, rollup["base_table"])
+        return change_version is not None and (last_rowid, change_version) == (
+            rollup["last_rowid"], rollup["change_version"])
+
+    def record(self, sql_query):
+        """
+        Counts the GROUP BY shapes of an executed query and queues a rollup build
+        for shapes that recur and are not covered by an existing rollup.
+        """
+        try:
+            shapes = parse_query_shapes(sql_query, self.schema)
+        except re.error as e:
+            logging.debug(f"Failed to parse query shape: {e}")
+            return
+
+        with self._lock:
+            rollups = self.rollups()
+            for shape in shapes:
+                dims = sorted(shape.dims)
+                measures = sorted(shape.measures - {"*"})
+                key = (shape.table_name, tuple(dims), tuple(measures))
+                if key in self._rejected or self._covering_rollup(shape, rollups):
+                    continue
+                self.shape_counts[key] = self.shape_counts.get(key, 0) + 1
+                if self.shape_counts[key] >= self.min_occurrences:
+                    self._submit(("build", key), self._create, shape.table_name, dims, measures, key)
+
+    def _create(self, base_table, dims, measures, key):
+        conn = self._worker_conn
+        rollups = self.rollups(conn)
+        if len(rollups) >= self.max_rollups or any(
+                rollup["base_table"] == base_table and set(dims) <= set(rollup["dims"])
+                and set(measures) <= set(rollup["measures"]) for rollup in rollups):
+            return
+        # Only worth it if grouping actually shrinks the table
+        row_count = conn.execute(f'SELECT COUNT(*) FROM main."{base_table}";').fetchone()[0]
+        group_by = ", ".join(dim_expression(dim) for dim in dims)
+        group_count = conn.execute(
+            f'SELECT COUNT(*) FROM (SELECT 1 FROM main."{base_table}"'
+            + (f" GROUP BY {group_by}" if group_by else "") + ");").fetchone()[0]
+        if row_count == 0 or group_count > row_count * self.max_group_ratio:
+            logging.debug(f"Not building rollup on {base_table}: {group_count} groups for {row_count} rows")
+            with self._lock:
+                self._rejected.add(key)
+            return
+
+        existing = {rollup["name"] for rollup in rollups}
+        idx = 1
+        while f"rollup_{base_table}_{idx}" in existing:
+            idx += 1
+        try:
+            self._build(f"rollup_{base_table}_{idx}", base_table, dims, measures)
+        except sqlite3.Error:
+            with self._lock:
+                self._rejected.add(key)
+            raise
+
+    def _covering_rollup(self, shape, rollups):
+        candidates = [
+            rollup for rollup in rollups
+            if rollup["base_table"] == shape.table_name
+            and shape.dims <= set(rollup["dims"])
+            and (shape.measures - {"*"}) <= set(rollup["measures"])
+        ]
+        return min(candidates, key=lambda rollup: rollup["group_count"], default=None)
+
+    def rewrite(self, sql_query):
+        """
+        Returns the query rewritten to read from a rollup, or None if no rollup matches.
+        """
+        try:
+            shapes = parse_query_shapes(explicit_column_names(sql_query), self.schema)
+        except re.error:
+            return None
+        if not shapes:
+            return None
+
+        rollups = self.rollups()
+        for shape in shapes:
+            rollup = self._covering_rollup(shape, rollups)
+            if rollup is None:
+                continue
+            if not self._is_current(rollup):
+                # Run directly until the worker has caught up with the table
+                self._submit(("refresh", rollup["base_table"]), self._refresh_table,
+                             rollup["base_table"])
+                continue
+            rewritten = self._render(shape, rollup)
+            if rewritten is not None:
+                logging.debug(f"Rewrote query to use rollup {rollup['name']}: {rewritten}")
+                return rewritten
+        return None
+
+    def _render(self, shape, rollup):
+        alias = shape.alias
+        dims = {dim: f"d{idx}" for idx, dim in enumerate(rollup["dims"])}
+        measures = {measure: f"m{idx}" for idx, measure in enumerate(rollup["measures"])}
+
+        rendered = []
+        for slot in shape.slots:
+            kind = slot[0]
+            if kind == "table":
+                rendered.append(f'{slot[1]} {ROLLUP_SCHEMA}."{rollup["name"]}" AS "{alias}"')
+            elif kind == "dim":
+                rendered.append(f'"{alias}".{dims[slot[1]]}')
+            elif kind == "agg":
+                function, measure = slot[1], slot[2]
+                if measure == "*":
+                    if function != "COUNT":
+                        return None
+                    rendered.append(f'SUM("{alias}".row_count)')
+                    continue
+                column = measures[measure]
+                rendered.append({
+                    "SUM": f'SUM("{alias}".sum_{column})',
+                    "TOTAL": f'TOTAL("{alias}".sum_{column})',
+                    "COUNT": f'SUM("{alias}".count_{column})',
+                    "MIN": f'MIN("{alias}".min_{column})',
+                    "MAX": f'MAX("{alias}".max_{column})',
+                    "AVG": f'(SUM("{alias}".sum_{column}) * 1.0 / SUM("{alias}".count_{column}))',
+                }[function])
+            else:
+                rendered.append(slot[-1])
+
+        return SLOT_PATTERN.sub(lambda match: rendered[int(match.group(1))], shape.template)
+
+    def describe(self):
+        """
+        Returns CREATE statements and comments describing the rollups, for the generation prompt.
+        """
+        lines = []
+        for rollup in self.rollups():
+            columns = [f"d{idx}" for idx in range(len(rollup["dims"]))] + ["row_count"]
+            columns += [f"{function}_m{idx}" for idx in range(len(rollup["measures"]))
+                        for function in AGGREGATE_COLUMNS]
+            lines.append(f'CREATE TABLE {ROLLUP_SCHEMA}.{rollup["name"]} ({", ".join(columns)});')
+            lines.append(f"-- Precomputed summary of {rollup['base_table']}, one row per group; "
+                         f"row_count = COUNT(*)")
+            for idx, dim in enumerate(rollup["dims"]):
+                lines.append(f"-- d{idx} = {dim_expression(dim).replace(chr(34), '')}")
+            for idx, measure in enumerate(rollup["measures"]):
+                lines.append(f"-- sum_m{idx}/count_m{idx}/min_m{idx}/max_m{idx} = "
+                             f"SUM/COUNT/MIN/MAX({measure})")
+        return "\n".join(lines)
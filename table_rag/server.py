@@ -0,0 +1,462 @@
+"""
+Headless JSON API around the TableRAG pipeline, as a plain ASGI application.
+
+    POST /query    {"question": ..., "database": ..., "session_id": ..., "explain": true,
+                    "dig_deeper": false, "stream": false, "max_rows": 1000}
+    GET  /health   liveness and readiness (503 while starting or draining)
+    GET  /metrics  Prometheus text format
+
+Each configured database gets one TableRAG (catalog, cell store, caches);
+sessions share it with their own message history. At most max_concurrency
+questions run at once and max_queue more wait for a slot, beyond that requests
+are rejected with 429. Streaming requests receive one NDJSON event per stage.
+
+    python -m table_rag.server --db bbq=bbq_manufacturing.db --port 8000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from table_rag import TableRAG
+
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = list(headers)
+
+
+def _json_body(data):
+    # DuckDB returns Decimal and date values
+    return json.dumps(data, default=str).encode("utf-8")
+
+
+async def send_json(send, status, data, headers=()):
+    body = _json_body(data)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise HTTPError(400, "Client disconnected")
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_SIZE:
+            raise HTTPError(413, "Request body too large")
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body or b"{}")
+    except json.JSONDecodeError as e:
+        raise HTTPError(400, f"Invalid JSON: {e}")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Expected a JSON object")
+    return data
+
+
+class TableRAGService:
+    """
+    Runs questions against a set of named databases with bounded concurrency.
+
+    databases maps a database name to its path; rag_options are passed to every
+    TableRAG. db_workers bounds the threads that run queries.
+    """
+
+    def __init__(self, databases, llm_client, rag_options=None, max_concurrency=4, max_queue=16,
+                 queue_timeout=30, db_workers=8, max_sessions=1000, session_ttl=1800,
+                 shutdown_timeout=30):
+        if not databases:
+            raise ValueError("TableRAGService needs at least one database")
+        self.databases = dict(databases)
+        self.default_database = next(iter(self.databases))
+        self.llm_client = llm_client
+        self.rag_options = dict(rag_options or {})
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.db_workers = db_workers
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.shutdown_timeout = shutdown_timeout
+
+        self.rags = {}
+        # (database, session id) -> [TableRAG session, asyncio.Lock, last used]
+        self.sessions = OrderedDict()
+        self.ready = False
+        self.draining = False
+        self.in_flight = 0
+        self.waiting = 0
+        self.metrics = {"requests": {}, "rejected": 0, "latency_sum": 0.0, "latency_count": 0}
+        self._slots = None
+        self._idle = None
+        self._executor = None
+
+    async def startup(self):
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Queries run through asyncio.to_thread, which uses the default executor
+        self._executor = ThreadPoolExecutor(self.db_workers, thread_name_prefix="table-rag-db")
+        asyncio.get_running_loop().set_default_executor(self._executor)
+
+        for name, db_path in self.databases.items():
+            self.rags[name] = await asyncio.to_thread(
+                TableRAG, db_path, self.llm_client, **self.rag_options)
+            logging.info(f"Loaded database {name} from {db_path}")
+        self.ready = True
+
+    def drain(self):
+        """
+        Stops admitting requests; queued ones are answered with 503 once they get a slot.
+        """
+        if not self.draining:
+            self.draining = True
+            logging.info(f"Draining {self.in_flight} running and {self.waiting} queued requests")
+
+    async def shutdown(self):
+        """
+        Stops admitting requests, waits up to shutdown_timeout for the running ones and releases the databases.
+        """
+        self.drain()
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Shutting down with {self.in_flight} requests still running")
+        for rag in self.rags.values():
+            if rag.rollup_cache:
+                rag.rollup_cache.close()
+        self._executor.shutdown(wait=False)
+
+    def count(self, status):
+        self.metrics["requests"][status] = self.metrics["requests"].get(status, 0) + 1
+
+    async def acquire(self):
+        if self.draining or not self.ready:
+            raise HTTPError(503, "Service is not accepting requests", [(b"retry-after", b"5")])
+        if self.in_flight + self.waiting >= self.max_concurrency + self.max_queue:
+            self.metrics["rejected"] += 1
+            raise HTTPError(429, "Too many requests", [(b"retry-after", b"1")])
+
+        self.waiting += 1
+        self._idle.clear()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.metrics["rejected"] += 1
+            raise HTTPError(429, "Timed out waiting for a free worker", [(b"retry-after", b"1")])
+        finally:
+            self.waiting -= 1
+            self._update_idle()
+
+        # Shutdown may have started while this request was queued
+        if self.draining:
+            self._slots.release()
+            self._update_idle()
+            raise HTTPError(503, "Service is not accepting requests", [(b"retry-after", b"5")])
+        self.in_flight += 1
+        self._idle.clear()
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+        self._update_idle()
+
+    def _update_idle(self):
+        # Idle only once nothing runs and nothing waits for a slot
+        if self.in_flight == 0 and self.waiting == 0:
+            self._idle.set()
+
+    def session(self, database, session_id):
+        now = time.monotonic()
+        while self.sessions:
+            key, (_, lock, last_used) = next(iter(self.sessions.items()))
+            if len(self.sessions) < self.max_sessions and now - last_used < self.session_ttl:
+                break
+            if lock.locked() and len(self.sessions) < self.max_sessions:
+                break
+            del self.sessions[key]
+
+        key = (database, session_id)
+        if key not in self.sessions:
+            self.sessions[key] = [self.rags[database].session(), asyncio.Lock(), now]
+        self.sessions.move_to_end(key)
+        self.sessions[key][2] = now
+        return self.sessions[key]
+
+    async def answer(self, rag, question, explain=True, dig_deeper=False, max_rows=1000):
+        """
+        Runs the pipeline for one question, yielding (event, data) after each stage.
+        """
+        sql_query = await rag.generate_sql_query(question)
+        yield "sql", {"sql": sql_query}
+
+        results, columns = await rag.execute_sql_query(question, sql_query)
+        if columns is None:
+            raise HTTPError(422, "The query failed after all healing attempts")
+        yield "result", {"columns": columns, "rows": results[:max_rows],
+                         "row_count": len(results), "truncated": len(results) > max_rows}
+        if not results:
+            return
+
+        result_digest = await asyncio.to_thread(rag.digest_result, results, columns)
+        rag.add_message({"role": "assistant", "content": result_digest})
+        explanation = None
+        if explain or dig_deeper:
+            explanation = await rag.explain_result(result_digest, question)
+            rag.add_message({"role": "assistant", "content": explanation})
+            yield "explanation", {"explanation": explanation}
+
+        if dig_deeper:
+            # Best effort, the answer above stands if the follow-up fails
+            try:
+                async for event, data in self.dig_deeper(rag, question, sql_query, result_digest,
+                                                         explanation, max_rows):
+                    yield event, data
+            except Exception as e:
+                logging.error(f"Error in dig deeper: {e}")
+                yield "deeper_error", {"error": str(e)}
+
+    async def dig_deeper(self, rag, question, sql_query, result_digest, explanation, max_rows):
+        deeper_sql = await rag.dig_deeper(sql_query, result_digest, question, explanation)
+        yield "deeper_sql", {"sql": deeper_sql}
+        deeper_results, deeper_columns = await rag.execute_sql_query(question, deeper_sql)
+        if deeper_columns is None:
+            raise ValueError("The deeper query failed after all healing attempts")
+        yield "deeper_result", {"columns": deeper_columns, "rows": deeper_results[:max_rows],
+                                "row_count": len(deeper_results),
+                                "truncated": len(deeper_results) > max_rows}
+        if deeper_results:
+            deeper_digest = await asyncio.to_thread(rag.digest_result, deeper_results, deeper_columns)
+            rag.add_message({"role": "assistant", "content": deeper_digest})
+            deeper_explanation = await rag.explain_result(deeper_digest, question)
+            rag.add_message({"role": "assistant", "content": deeper_explanation})
+            yield "deeper_explanation", {"explanation": deeper_explanation}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        started = time.monotonic()
+        status = 500
+        try:
+            status = await self.route(scope, receive, send)
+        except HTTPError as e:
+            status = e.status
+            await send_json(send, e.status, {"error": e.message}, e.headers)
+        except Exception as e:
+            logging.exception(f"Failed to handle {scope['path']}: {e}")
+            await send_json(send, 500, {"error": str(e)})
+        finally:
+            self.count(status)
+            if scope["path"] == "/query":
+                self.metrics["latency_sum"] += time.monotonic() - started
+                self.metrics["latency_count"] += 1
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logging.exception("Failed to start the TableRAG service")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def route(self, scope, receive, send):
+        method, path = scope["method"], scope["path"]
+        if path == "/health":
+            status = 200 if self.ready and not self.draining else 503
+            await send_json(send, status, {
+                "status": "ok" if status == 200 else ("draining" if self.draining else "starting"),
+                "databases": list(self.rags), "in_flight": self.in_flight, "queued": self.waiting})
+            return status
+        if path == "/metrics":
+            body = self.render_metrics().encode("utf-8")
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"text/plain; version=0.0.4")]})
+            await send({"type": "http.response.body", "body": body})
+            return 200
+        if path != "/query":
+            raise HTTPError(404, f"Not found: {path}")
+        if method != "POST":
+            raise HTTPError(405, "Use POST", [(b"allow", b"POST")])
+        return await self.query(scope, receive, send)
+
+    async def query(self, scope, receive, send):
+        request = await read_json(receive)
+        question = request.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise HTTPError(400, "Missing question")
+        database = request.get("database") or self.default_database
+        if database not in self.databases:
+            raise HTTPError(404, f"Unknown database: {database}")
+        session_id = str(request.get("session_id") or uuid.uuid4().hex)
+        try:
+            max_rows = int(request.get("max_rows", 1000))
+        except (TypeError, ValueError):
+            raise HTTPError(400, "max_rows must be an integer")
+        options = {
+            "explain": bool(request.get("explain", True)),
+            "dig_deeper": bool(request.get("dig_deeper", False)),
+            "max_rows": max_rows,
+        }
+        accept = dict(scope["headers"]).get(b"accept", b"")
+        stream = request.get("stream", b"application/x-ndjson" in accept)
+
+        await self.acquire()
+        try:
+            rag, lock, _ = self.session(database, session_id)
+            # Questions of one session run in order, they extend the same history
+            async with lock:
+                events = self.answer(rag, question, **options)
+                if stream:
+                    return await self.stream(send, events, database, session_id)
+
+                response = {"database": database, "session_id": session_id}
+                async for event, data in events:
+                    if event.startswith("deeper_"):
+                        response.setdefault("deeper", {})[event[len("deeper_"):]] = data
+                    else:
+                        response.update(data)
+                await send_json(send, 200, response)
+                return 200
+        finally:
+            self.release()
+
+    async def stream(self, send, events, database, session_id):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson")]})
+
+        async def emit(event, data):
+            line = _json_body({"event": event, **data}) + b"\n"
+            await send({"type": "http.response.body", "body": line, "more_body": True})
+
+        await emit("session", {"database": database, "session_id": session_id})
+        status = 200
+        try:
+            async for event, data in events:
+                await emit(event, data)
+            await emit("done", {})
+        except HTTPError as e:
+            status = e.status
+            await emit("error", {"status": e.status, "error": e.message})
+        except Exception as e:
+            logging.exception(f"Failed to answer streaming request: {e}")
+            status = 500
+            await emit("error", {"status": 500, "error": str(e)})
+        await send({"type": "http.response.body", "body": b""})
+        return status
+
+    def render_metrics(self):
+        lines = [
+            "# TYPE table_rag_requests_total counter",
+            *(f'table_rag_requests_total{{status="{status}"}} {count}'
+              for status, count in sorted(self.metrics["requests"].items())),
+            "# TYPE table_rag_rejected_total counter",
+            f"table_rag_rejected_total {self.metrics['rejected']}",
+            "# TYPE table_rag_query_seconds summary",
+            f"table_rag_query_seconds_sum {self.metrics['latency_sum']:.6f}",
+            f"table_rag_query_seconds_count {self.metrics['latency_count']}",
+            "# TYPE table_rag_in_flight gauge",
+            f"table_rag_in_flight {self.in_flight}",
+            "# TYPE table_rag_queued gauge",
+            f"table_rag_queued {self.waiting}",
+            "# TYPE table_rag_sessions gauge",
+            f"table_rag_sessions {len(self.sessions)}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def create_app(databases, llm_client=None, **options):
+    """
+    Returns the ASGI application for {database name: path}, serve it with any ASGI server.
+    """
+    if llm_client is None:
+        from openai import AsyncOpenAI
+        from table_rag import LLM_API_KEY, LLM_API_SERVER
+        llm_client = AsyncOpenAI(api_key=LLM_API_KEY, base_url=LLM_API_SERVER)
+    return TableRAGService(databases, llm_client, **options)
+
+
+def _parse_database(value):
+    name, _, db_path = value.rpartition("=")
+    return (name or Path(db_path).stem), db_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve TableRAG as a JSON API.")
+    parser.add_argument("--db", action="append", type=_parse_database, metavar="[NAME=]PATH",
+                        help="Database to serve, the first one is the default")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=4,
+                        help="Questions answered at the same time")
+    parser.add_argument("--max-queue", type=int, default=16,
+                        help="Questions waiting for a slot before new ones get 429")
+    parser.add_argument("--queue-timeout", type=float, default=30)
+    parser.add_argument("--db-workers", type=int, default=8, help="Threads running queries")
+    parser.add_argument("--shutdown-timeout", type=float, default=30)
+    parser.add_argument("--fused-generation", action="store_true",
+                        help="Expand and generate SQL in a single LLM call")
+    args = parser.parse_args(argv)
+
+    databases = dict(args.db or [])
+    if not databases:
+        db_path = os.environ.get("TABLE_RAG_DB", "bbq_manufacturing.db")
+        databases = {Path(db_path).stem: db_path}
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise ImportError("The TableRAG server requires the uvicorn package (pip install uvicorn)")
+
+    app = create_app(
+        databases, rag_options={"fused_generation": args.fused_generation},
+        max_concurrency=args.max_concurrency, max_queue=args.max_queue,
+        queue_timeout=args.queue_timeout, db_workers=args.db_workers,
+        shutdown_timeout=args.shutdown_timeout)
+    server = uvicorn.Server(uvicorn.Config(
+        app, host=args.host, port=args.port, lifespan="on",
+        timeout_graceful_shutdown=args.shutdown_timeout))
+    handle_exit = server.handle_exit
+
+    def drain_and_exit(sig, frame):
+        # uvicorn only sends lifespan.shutdown after it has waited for the running
+        # requests, so start draining as soon as the signal arrives
+        app.drain()
+        handle_exit(sig, frame)
+
+    server.handle_exit = drain_and_exit
+    server.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import re
+
+from tabulate import tabulate
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}(-\d{2})?([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return f"{value:,.4g}" if abs(value) < 1e4 else f"{value:,.2f}"
+    return f"{value:,}"
+
+
+def _truncate(value, max_length):
+    text = str(value)
+    return text if len(text) <= max_length else text[:max_length - 3] + "..."
+
+
+def _sample_indexes(row_count, sample_size):
+    # Evenly spaced rows, always including the first and last
+    if row_count <= sample_size:
+        return list(range(row_count))
+    step = (row_count - 1) / (sample_size - 1)
+    return sorted({round(idx * step) for idx in range(sample_size)})
+
+
+def profile_column(values):
+    """
+    Returns a profile of a result column: kind ("number", "date", "text" or "empty"),
+    non-null count and kind-specific aggregates.
+    """
+    present = [value for value in values if value is not None]
+    profile = {"non_null": len(present)}
+    if not present:
+        profile["kind"] = "empty"
+        return profile
+
+    numbers = [value for value in present if _is_number(value)]
+    if len(numbers) == len(present):
+        total = sum(numbers)
+        profile.update(kind="number", min=min(numbers), max=max(numbers),
+                       sum=total, mean=total / len(numbers))
+        return profile
+
+    texts = [str(value) for value in present]
+    if all(DATE_PATTERN.match(text) for text in texts):
+        profile.update(kind="date", min=min(texts), max=max(texts))
+        return profile
+
+    counts = {}
+    for text in texts:
+        counts[text] = counts.get(text, 0) + 1
+    top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:5]
+    profile.update(kind="text", distinct=len(counts), top=top)
+    return profile
+
+
+def describe_trend(dates, numbers, buckets=6):
+    """
+    Describes how a numeric column moves over a date column, using up to `buckets` periods.
+    """
+    pairs = sorted((str(date), number) for date, number in zip(dates, numbers)
+                   if date is not None and _is_number(number))
+    if len(pairs) < 2:
+        return None
+
+    # Equal-sized periods, so the first and last totals are comparable
+    buckets = min(buckets, len(pairs))
+    bounds = [idx * len(pairs) // buckets for idx in range(buckets + 1)]
+    periods = []
+    for start, end in zip(bounds, bounds[1:]):
+        chunk = pairs[start:end]
+        periods.append((chunk[0][0], chunk[-1][0], sum(number for _, number in chunk)))
+
+    first, last = periods[0][2], periods[-1][2]
+    if first:
+        change = f"{(last - first) / abs(first):+.1%}"
+    else:
+        change = "n/a"
+    series = ", ".join(f"{start[:10]}..{end[:10]}: {_format_number(total)}"
+                       for start, end, total in periods)
+    return f"first period {_format_number(first)}, last period {_format_number(last)} ({change}); {series}"
+
+
+def summarize_result(results, columns, max_rows=30, max_cell_length=60, max_chars=6000):
+    """
+    Returns a bounded-size digest of a query result for the LLM.
+
+    Results with up to max_rows rows are rendered in full if that fits in
+    max_chars. Larger or wider results are reduced to the row count, per-column
+    aggregates, top and bottom rows by the first numeric measure, trends over
+    date columns and an evenly spaced sample, cut off at max_chars.
+    """
+    results = results or []
+    columns = list(columns or [])
+
+    def table(rows):
+        return tabulate([[_truncate(value, max_cell_length) for value in row] for row in rows],
+                        headers=columns, tablefmt="github")
+
+    if len(results) <= max_rows:
+        digest = table(results)
+        if len(digest) <= max_chars:
+            return digest
+
+    column_values = list(zip(*results))
+    profiles = [profile_column(values) for values in column_values]
+
+    lines = [f"Result has {len(results):,} rows and {len(columns)} columns. Summary:"]
+    for name, profile in zip(columns, profiles):
+        kind = profile["kind"]
+        if kind == "number":
+            lines.append(
+                f"- {name} (number, {profile['non_null']:,} values): min {_format_number(profile['min'])}, "
+                f"max {_format_number(profile['max'])}, mean {_format_number(profile['mean'])}, "
+                f"sum {_format_number(profile['sum'])}")
+        elif kind == "date":
+            lines.append(f"- {name} (date, {profile['non_null']:,} values): "
+                         f"from {profile['min']} to {profile['max']}")
+        elif kind == "text":
+            top = ", ".join(f"{_truncate(value, max_cell_length)} ({count})"
+                            for value, count in profile["top"])
+            lines.append(f"- {name} (text, {profile['distinct']:,} distinct): most frequent {top}")
+        else:
+            lines.append(f"- {name}: all NULL")
+
+    # Identifiers (`id`, `*_id`) make poor ranking keys and trends
+    number_columns = [idx for idx, profile in enumerate(profiles) if profile["kind"] == "number"]
+    measure_columns = [idx for idx in number_columns
+                       if not (columns[idx].lower() == "id" or columns[idx].lower().endswith("_id"))]
+    number_columns = measure_columns + [idx for idx in number_columns if idx not in measure_columns]
+    date_columns = [idx for idx, profile in enumerate(profiles) if profile["kind"] == "date"]
+
+    for date_idx in date_columns[:1]:
+        for number_idx in measure_columns[:3]:
+            trend = describe_trend(column_values[date_idx], column_values[number_idx])
+            if trend:
+                lines.append(f"Trend of {columns[number_idx]} over {columns[date_idx]}: {trend}")
+
+    section_rows = max(3, max_rows // 6)
+    if number_columns:
+        key = number_columns[0]
+        ranked = sorted((row for row in results if _is_number(row[key])),
+                        key=lambda row: row[key], reverse=True)
+        lines.append(f"\nTop {section_rows} rows by {columns[key]}:")
+        lines.append(table(ranked[:section_rows]))
+        lines.append(f"\nBottom {section_rows} rows by {columns[key]}:")
+        lines.append(table(ranked[-section_rows:]))
+
+    sample_size = max(2, max_rows - 2 * section_rows if number_columns else max_rows)
+    lines.append(f"\nSample of {min(sample_size, len(results))} rows in result order:")
+    lines.append(table([results[idx] for idx in _sample_indexes(len(results), sample_size)]))
+
+    digest = "\n".join(lines)
+    if len(digest) > max_chars:
+        digest = digest[:max_chars - 20] + "\n... (truncated)"
+    return digest
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from table_rag.ingest import infer_column_type, ingest_files
+
+
+def test_byte_order_mark_is_not_part_of_the_header(tmp_path):
+    csv_path = tmp_path / "sales.csv"
+    csv_path.write_bytes("\ufeffsale_id,quantity\n1,5\n2,7\n".encode("utf-8"))
+    db_path = tmp_path / "sales.db"
+
+    ingest_files([str(csv_path)], str(db_path))
+
+    conn = sqlite3.connect(db_path)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(sales);")]
+    indexes = [row[1] for row in conn.execute("PRAGMA index_list(sales);")]
+    conn.close()
+    assert columns == ["sale_id", "quantity"]
+    assert indexes == ["idx_sales_sale_id"]
+
+
+@pytest.mark.parametrize("values, column_type", [
+    (["1", "-2", "+30", "0", ""], "INTEGER"),
+    (["1.5", "2", ".5", "1e3", "0.25"], "REAL"),
+    (["01234", "90210"], "TEXT"),
+    (["0.5", "00.5"], "TEXT"),
+    (["1_000", "2"], "TEXT"),
+    ([" 12 ", "3"], "TEXT"),
+    (["nan", "1.0"], "TEXT"),
+    (["inf"], "TEXT"),
+    (["2024-01-31", "2023-12-01"], "DATE"),
+    (["2024-01-31 08:00", "2024-01-31T17:30:15"], "DATETIME"),
+    (["", ""], "TEXT"),
+])
+def test_infer_column_type(values, column_type):
+    assert infer_column_type(values) == column_type
+
+
+def test_leading_zeros_are_kept(tmp_path):
+    csv_path = tmp_path / "stores.csv"
+    csv_path.write_text("store_id,zip\n1,90210\n2,01234\n")
+    db_path = tmp_path / "stores.db"
+
+    ingest_files([str(csv_path)], str(db_path))
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT store_id, zip FROM stores ORDER BY rowid;").fetchall()
+    conn.close()
+    assert rows == [(1, "90210"), (2, "01234")]
@@ -0,0 +1,75 @@
+from pathlib import Path
+
+import pytest
+
+from table_rag.backends import SQLiteBackend
+from table_rag.planner import QueryPlanError, QueryPlanner
+
+DEMO_DB = Path(__file__).resolve().parent.parent / "bbq_manufacturing.db"
+
+CORRELATED_QUERY = (
+    "SELECT e.first_name, (SELECT SUM(quantity) FROM Sales s "
+    "WHERE s.employee_id = e.employee_id) AS units FROM Employees e")
+AUTOMATIC_INDEX_QUERY = (
+    "SELECT s.quantity, p.net_pay FROM Sales s JOIN Payroll p ON p.employee_id = s.employee_id")
+
+
+class SizedBackend(SQLiteBackend):
+    """
+    The demo database with the table sizes of a production one.
+    """
+
+    def __init__(self, db_path, rows):
+        super().__init__(db_path)
+        self.rows = rows
+
+    def estimate_rows(self, table_name):
+        return self.rows.get(table_name, super().estimate_rows(table_name))
+
+
+@pytest.fixture
+def planner():
+    backend = SizedBackend(str(DEMO_DB), {"Sales": 1_000_000, "Employees": 5000,
+                                          "Payroll": 20_000_000})
+    return QueryPlanner(backend)
+
+
+def test_correlated_subquery_scans_once_per_outer_row(planner):
+    analysis = planner.analyze(CORRELATED_QUERY)
+    assert analysis["avoidable_cost"] == 5000 * 1_000_000
+    with pytest.raises(QueryPlanError, match="correlated subquery"):
+        planner.check(CORRELATED_QUERY)
+
+
+def test_uncorrelated_subquery_runs_once(planner):
+    analysis = planner.analyze(
+        "SELECT e.first_name FROM Employees e WHERE e.salary > (SELECT AVG(salary) FROM Employees)")
+    assert analysis["avoidable_cost"] == 0
+
+
+def test_automatic_index_is_left_to_the_advisor(planner):
+    analysis = planner.check(AUTOMATIC_INDEX_QUERY)
+    assert analysis["avoidable_cost"] == 0
+    assert ("Payroll", ("employee_id",)) in analysis["patterns"]
+
+
+def test_leading_wildcard_on_a_large_table_is_rejected(planner):
+    with pytest.raises(QueryPlanError):
+        planner.check("SELECT p.net_pay FROM Payroll p WHERE p.pay_period_start LIKE '%-05-%'")
+    assert planner.analyze("SELECT p.net_pay FROM Payroll p WHERE p.pay_period_start LIKE '2024-05-%'"
+                           )["avoidable_cost"] == 0
+
+
+@pytest.mark.parametrize("sql_query, pattern", [
+    ("SELECT SUM(quantity) FROM Sales WHERE employee_id = 5", ("Sales", ("employee_id",))),
+    ("SELECT SUM(quantity) FROM Sales WHERE 5 = employee_id", ("Sales", ("employee_id",))),
+    ("SELECT e.first_name, SUM(s.quantity) FROM Employees e JOIN Sales s "
+     "ON e.employee_id = s.employee_id GROUP BY e.first_name", ("Sales", ("employee_id",))),
+])
+def test_predicates_are_recorded(planner, sql_query, pattern):
+    assert pattern in planner.analyze(sql_query)["patterns"]
+
+
+def test_string_literals_are_not_predicates(planner):
+    analysis = planner.analyze("SELECT SUM(quantity) FROM Sales WHERE sale_date > 'product_id = 1'")
+    assert analysis["patterns"] == [("Sales", ("sale_date",))]
@@ -0,0 +1,134 @@
+import shutil
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from table_rag.backends import SQLiteBackend
+from table_rag.catalog import build_catalog
+from table_rag.rollups import ROLLUP_SCHEMA, RollupCache
+
+DEMO_DB = Path(__file__).resolve().parent.parent / "bbq_manufacturing.db"
+
+# Queries the rewriter must either answer exactly like the base tables or leave alone
+QUERIES = [
+    "SELECT product_id, SUM(quantity) AS total FROM Sales GROUP BY product_id",
+    "SELECT s.product_id, COUNT(*) AS sales, AVG(s.sale_price) AS price, "
+    "MIN(s.quantity) AS low, MAX(s.quantity) AS high FROM Sales s GROUP BY s.product_id",
+    "SELECT p.product_name, SUM(s.quantity * s.sale_price) AS revenue FROM Sales s "
+    "JOIN Products p ON p.product_id = s.product_id GROUP BY p.product_name",
+    "SELECT strftime('%Y-%m', s.sale_date) AS month, SUM(s.quantity) AS units FROM Sales s "
+    "GROUP BY month",
+    "SELECT e.first_name, e.last_name, SUM(s.quantity) AS units FROM Sales s "
+    "JOIN Employees e ON e.employee_id = s.employee_id "
+    "GROUP BY e.employee_id, e.first_name, e.last_name",
+    "SELECT s.employee_id, COUNT(DISTINCT s.product_id) AS products FROM Sales s GROUP BY s.employee_id",
+    # The bare quantity in ORDER BY is the output alias, not the column
+    "SELECT product_id, SUM(quantity) AS quantity FROM Sales GROUP BY product_id "
+    "ORDER BY quantity DESC LIMIT 3",
+    # Products without a matching sale must still count as one row
+    "SELECT p.product_name, COUNT(*) AS n, COUNT(s.quantity) AS sold FROM Products p "
+    "LEFT JOIN Sales s ON s.product_id = p.product_id AND s.quantity > 1000 "
+    "GROUP BY p.product_name",
+]
+
+
+@pytest.fixture
+def rollups(tmp_path):
+    db_path = tmp_path / "bbq.db"
+    rollup_path = tmp_path / "rollups.db"
+    shutil.copy(DEMO_DB, db_path)
+
+    backend = SQLiteBackend(str(db_path))
+    schema, _, _ = build_catalog(backend, workers=1)
+    cache = RollupCache(str(db_path), str(rollup_path), schema, min_occurrences=1)
+    backend.attach(ROLLUP_SCHEMA, str(rollup_path))
+    yield cache, backend, db_path
+    cache.close()
+
+
+def record(cache, sql_query):
+    cache.record(sql_query)
+    cache.wait()
+
+
+def change(db_path, statements):
+    conn = sqlite3.connect(db_path)
+    for statement in statements:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+
+def assert_equivalent(cache, backend, sql_query):
+    direct, _ = backend.execute(sql_query)
+    rewritten = cache.rewrite(sql_query)
+    if rewritten is None:
+        return False
+    results, _ = backend.execute(rewritten)
+    if "ORDER BY" in sql_query:
+        assert results == direct, rewritten
+    else:
+        assert sorted(results, key=repr) == sorted(direct, key=repr), rewritten
+    return True
+
+
+@pytest.mark.parametrize("sql_query", QUERIES)
+def test_rewrite_matches_direct_execution(rollups, sql_query):
+    cache, backend, _ = rollups
+    record(cache, sql_query)
+    assert_equivalent(cache, backend, sql_query)
+
+
+def test_supported_queries_are_rewritten(rollups):
+    cache, backend, _ = rollups
+    for sql_query in QUERIES[:5]:
+        record(cache, sql_query)
+        assert assert_equivalent(cache, backend, sql_query), sql_query
+
+
+def test_alias_shadowing_and_outer_joins_run_directly(rollups):
+    cache, _, _ = rollups
+    for sql_query in QUERIES[-2:]:
+        record(cache, sql_query)
+        assert cache.rewrite(sql_query) is None
+
+
+@pytest.mark.parametrize("statements", [
+    ["UPDATE Sales SET quantity = quantity + 100 WHERE sales_id < 50"],
+    ["DELETE FROM Sales WHERE sales_id BETWEEN 60 AND 70"],
+    ["INSERT INTO Sales (employee_id, product_id, quantity, sale_price, sale_date) "
+     "VALUES (1, 2, 5, 10.0, '2024-01-01')"],
+    ["DELETE FROM Sales WHERE sales_id BETWEEN 80 AND 90",
+     "INSERT INTO Sales (employee_id, product_id, quantity, sale_price, sale_date) "
+     "VALUES (1, 2, 5, 10.0, '2024-01-01')"],
+])
+def test_rollups_follow_changes_to_the_base_table(rollups, statements):
+    cache, backend, db_path = rollups
+    sql_query = QUERIES[1]
+    record(cache, sql_query)
+    assert assert_equivalent(cache, backend, sql_query)
+
+    change(db_path, statements)
+    # Stale rollups are skipped while the worker refreshes them
+    assert cache.rewrite(sql_query) is None
+    cache.wait()
+    assert assert_equivalent(cache, backend, sql_query)
+
+
+@pytest.mark.parametrize("statements", [
+    ["INSERT INTO Payroll (employee_id, hours_worked) VALUES (1, 8)"],
+    ["UPDATE Payroll SET hours_worked = hours_worked + 1"],
+    ["CREATE INDEX idx_payroll_employee ON Payroll (employee_id)"],
+])
+def test_changes_to_other_tables_keep_rollups(rollups, monkeypatch, statements):
+    cache, backend, db_path = rollups
+    sql_query = QUERIES[1]
+    record(cache, sql_query)
+    builds = []
+    monkeypatch.setattr(cache, "_build", lambda *args: builds.append(args))
+
+    change(db_path, statements)
+    assert assert_equivalent(cache, backend, sql_query)
+    cache.wait()
+    assert builds == []
@@ -0,0 +1,17 @@
+import pytest
+
+from table_rag.summarize import summarize_result
+
+
+@pytest.mark.parametrize("row_count", [5, 30, 60, 1000])
+@pytest.mark.parametrize("column_count", [3, 300])
+def test_digest_is_bounded(row_count, column_count):
+    columns = [f"column_{idx}" for idx in range(column_count)]
+    results = [[row * column_count + idx for idx in range(column_count)] for row in range(row_count)]
+    assert len(summarize_result(results, columns, max_rows=30, max_chars=6000)) <= 6000
+
+
+def test_small_results_are_rendered_in_full():
+    digest = summarize_result([("Sarah", 52000.0), ("Tom", 48000.0)], ["name", "salary"])
+    assert "Sarah" in digest and "Tom" in digest
+    assert "Summary" not in digest